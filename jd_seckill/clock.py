@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import threading
+import time
+
+from datetime import datetime
+
+from .config import global_config
+from .exception import SKException
+
+
+class SystemClock(object):
+    """
+    系统时钟
+    """
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock(object):
+    """
+    模拟时钟，sleep 不真正等待而是直接推进时间，完整的抢购流程可以在毫秒级完成
+    true_time 为模拟的标准时间（可视为京东服务器时间），本地时钟在此基础上可以设置：
+        skew：本地时钟比标准时间快多少秒
+        drift：本地时钟每走1秒多走多少秒，如 50ppm 为 0.00005
+    多线程同时 sleep 时各自推进时间，仅适合单线程或对并发时序要求不高的场景
+    """
+
+    def __init__(self, start=None, skew=0.0, drift=0.0):
+        self.start = start if start is not None else time.time()
+        self.true_time = self.start
+        self.skew = skew
+        self.drift = drift
+        self.lock = threading.Lock()
+
+    def time(self):
+        with self.lock:
+            return self.true_time + self.skew + (self.true_time - self.start) * self.drift
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def advance(self, seconds):
+        """
+        标准时间推进 seconds 秒
+        """
+        with self.lock:
+            self.true_time += seconds
+
+    def sleep(self, seconds):
+        # 本地时钟走过 seconds 秒对应的标准时间
+        self.advance(max(seconds, 0) / (1 + self.drift))
+
+
+_clock = None
+
+
+def get_clock():
+    """
+    获取全局时钟，配置 simulated_clock = true 时使用模拟时钟
+    模拟时钟下所有等待都不会真正发生，只允许与 replay_file 回放一起使用，避免以零间隔请求京东
+    """
+    global _clock
+    if _clock is None:
+        if global_config.getRaw('debug', 'simulated_clock', 'false') == 'true':
+            if not global_config.getRaw('debug', 'replay_file', ''):
+                raise SKException('simulated_clock 只能在回放模式下使用，请同时配置 replay_file')
+            _clock = SimulatedClock()
+        else:
+            _clock = SystemClock()
+    return _clock
+
+
+def set_clock(clock):
+    """
+    替换全局时钟，Timer、抢购循环、等待函数都将使用该时钟
+    """
+    global _clock
+    _clock = clock
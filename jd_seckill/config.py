@@ -26,10 +26,18 @@ class Config(object):
         self._configRaw = configparser.RawConfigParser(interpolation=EnvInterpolation())
         self._configRaw.read(self._path, encoding='utf-8-sig')
 
-    def get(self, section, name):
+    def get(self, section, name, fallback=None):
+        if fallback is not None:
+            return self._config.get(section, name, fallback=fallback)
         return self._config.get(section, name)
 
-    def getRaw(self, section, name):
+    def getRaw(self, section, name, fallback=None):
+        """
+        读取原始配置值
+        :param fallback: 旧版本配置文件中没有该项时使用的默认值，为None时缺失配置直接抛出异常
+        """
+        if fallback is not None:
+            return self._configRaw.get(section, name, fallback=fallback)
         return self._configRaw.get(section, name)
 
 
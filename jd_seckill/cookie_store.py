@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import os
+import pickle
+import re
+import time
+
+from .jd_logger import logger
+from .util import read_json_file, write_json_file
+
+# 判断登录态有效期所依据的cookie
+AUTH_COOKIE_NAMES = ('pt_key', 'pt_pin', 'thor')
+
+
+class CookieStore(object):
+    """
+    按账号索引的多账号Cookie存储
+    目录下的 index.json 记录每个账号的cookie文件、过期时间、保存时间，
+    加载时只读取索引和目标账号的cookie文件，与目录中的账号数量无关
+    index.json 格式：
+        {"default": "账号", "accounts": {"账号": {"file": "", "nick_name": "", "expires": 0, "saved_at": 0}}}
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.index_path = os.path.join(dir_path, self.INDEX_FILE)
+
+    @staticmethod
+    def account_of(cookies):
+        """
+        从cookie中取账号标识（pt_pin），取不到时返回None
+        """
+        for cookie in cookies:
+            if cookie.name == 'pt_pin' and cookie.value:
+                return cookie.value
+        return None
+
+    @staticmethod
+    def expires_of(cookies):
+        """
+        登录态cookie中最早的过期时间戳，均为会话cookie时返回None
+        """
+        expires = [cookie.expires for cookie in cookies if cookie.name in AUTH_COOKIE_NAMES and cookie.expires]
+        return min(expires) if expires else None
+
+    def load_index(self):
+        index = read_json_file(self.index_path)
+        if index is None:
+            index = self._migrate()
+        return index
+
+    def _migrate(self):
+        """
+        旧版本直接以昵称保存 *.cookies 文件，首次使用时为其建立索引
+        """
+        index = {'default': None, 'accounts': {}}
+        if not os.path.exists(self.dir_path):
+            return index
+        for name in sorted(os.listdir(self.dir_path)):
+            if not name.endswith('.cookies'):
+                continue
+            try:
+                cookies = self._read(name)
+            except Exception as e:
+                logger.info('读取cookie文件【%s】失败: %s', name, e)
+                continue
+            account = self.account_of(cookies) or name[:-len('.cookies')]
+            index['accounts'][account] = self._entry(name, cookies, name[:-len('.cookies')])
+            index['default'] = index['default'] or account
+        if index['accounts']:
+            write_json_file(self.index_path, index)
+            logger.info('已为%s个本地cookie文件建立索引', len(index['accounts']))
+        return index
+
+    def _entry(self, file_name, cookies, nick_name):
+        return {
+            'file': file_name,
+            'nick_name': nick_name,
+            'expires': self.expires_of(cookies),
+            'saved_at': time.time(),
+        }
+
+    def _read(self, file_name):
+        with open(os.path.join(self.dir_path, file_name), 'rb') as f:
+            return pickle.load(f)
+
+    def load(self, account=None):
+        """
+        加载账号的cookie
+        :param account: 账号，为空时加载最近保存的账号
+        :return: (账号, cookies)，没有可用cookie时返回 (None, None)
+        """
+        index = self.load_index()
+        account = account or index.get('default')
+        entry = index['accounts'].get(account) if account else None
+        if not entry:
+            return None, None
+        if entry.get('expires') and entry['expires'] < time.time():
+            logger.info('账号【%s】的cookie已过期', entry.get('nick_name') or account)
+            return None, None
+        try:
+            return account, self._read(entry['file'])
+        except Exception as e:
+            logger.info('读取cookie文件【%s】失败: %s', entry['file'], e)
+            return None, None
+
+    def save(self, cookies, nick_name):
+        """
+        保存cookie并更新索引，cookie文件和索引均先写临时文件再替换
+        :param cookies: cookie jar
+        :param nick_name: 用户昵称，取不到账号标识时作为账号
+        :return: 账号
+        """
+        account = self.account_of(cookies) or nick_name
+        file_name = '{}.cookies'.format(re.sub(r'[^\w\-.%]', '_', account))
+        if not os.path.exists(self.dir_path):
+            os.makedirs(self.dir_path)
+        path = os.path.join(self.dir_path, file_name)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cookies, f)
+        os.replace(tmp_path, path)
+
+        index = self.load_index()
+        index['accounts'][account] = self._entry(file_name, cookies, nick_name)
+        index['default'] = account
+        write_json_file(self.index_path, index)
+        return account
+
+    def update(self, account, **fields):
+        """
+        更新账号索引中的附加信息
+        """
+        index = self.load_index()
+        if account not in index['accounts']:
+            return
+        index['accounts'][account].update(fields)
+        write_json_file(self.index_path, index)
+
+    def get_entry(self, account):
+        return self.load_index()['accounts'].get(account)
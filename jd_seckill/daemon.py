@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+from datetime import datetime, timedelta
+
+from .jd_logger import logger
+from .config import global_config
+from .clock import get_clock
+from .profiling import write_summary
+from . import journal
+
+
+def parse_time_of_day(value):
+    """
+    解析每日执行时间，格式 '09:59:59.820' 或 '09:00:00'
+    """
+    for fmt in ("%H:%M:%S.%f", "%H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    raise ValueError('时间格式错误: {}'.format(value))
+
+
+class SeckillDaemon(object):
+    """
+    常驻模式
+    按每日计划执行预约和抢购，两次执行之间保持进程、Session、cookie、eid/fp和时间同步结果，
+    每次执行前只刷新已经过期的部分：
+        login：登录校验结果超过 login_check_ttl 时重新校验
+        eid_fp：本地缓存超过 eid_fp_cache_ttl 时重新获取
+        timer：距上次时间同步超过 [daemon] clock_sync_ttl 时重新同步
+    """
+
+    def __init__(self, jd_seckill):
+        self.jd_seckill = jd_seckill
+        reserve_time = global_config.getRaw('daemon', 'reserve_time', '')
+        self.reserve_time = parse_time_of_day(reserve_time) if reserve_time else None
+        seckill_time = global_config.getRaw('daemon', 'seckill_time', '')
+        self.seckill_time = parse_time_of_day(seckill_time) if seckill_time else self.jd_seckill.timers.buy_time.time()
+        # 提前多少秒唤醒并刷新过期状态
+        self.prepare_time = int(global_config.getRaw('daemon', 'prepare_time', '120'))
+        # 时间同步的有效期；单位：分钟
+        self.clock_sync_ttl = float(global_config.getRaw('daemon', 'clock_sync_ttl', '60')) * 60
+
+    @staticmethod
+    def next_run(time_of_day, now):
+        run_at = datetime.combine(now.date(), time_of_day)
+        return run_at if run_at > now else run_at + timedelta(days=1)
+
+    def next_job(self):
+        now = get_clock().now()
+        jobs = [(self.next_run(self.seckill_time, now), 'seckill')]
+        if self.reserve_time:
+            jobs.append((self.next_run(self.reserve_time, now), 'reserve'))
+        return min(jobs)
+
+    def sleep_until(self, run_at):
+        clock = get_clock()
+        while True:
+            remain = (run_at - clock.now()).total_seconds()
+            if remain <= 0:
+                return
+            # 分段休眠，便于Ctrl+C退出
+            clock.sleep(min(remain, 60))
+
+    def refresh_stale(self):
+        """
+        重新执行已过期的预热阶段
+        """
+        jd_seckill = self.jd_seckill
+        # 登录校验与eid/fp均有本地缓存，未过期时不会访问网络或启动浏览器
+        # 下单参数每次抢购前都用最新的初始化信息重新校验
+        jd_seckill.reset_login_stages()
+        jd_seckill.order_body_used.clear()
+        if get_clock().time() - jd_seckill.timers.synced_at > self.clock_sync_ttl:
+            jd_seckill.warmed_stages.discard('timer')
+        else:
+            logger.info('时间同步结果仍在有效期内，无需重新同步')
+
+    def run_job(self, job, run_at):
+        jd_seckill = self.jd_seckill
+        journal.new_run()
+        if job == 'reserve':
+            if global_config.getRaw('config', 'reserve_sku_ids', ''):
+                jd_seckill.reserve_by_thread_pool()
+            else:
+                # 只预约一次（内部有限次重试），商品不在预约期时不会阻塞之后的抢购计划
+                result = jd_seckill.reserve()
+                if not result or not result['success']:
+                    logger.info('本次预约未成功，等待下一次计划：%s', result['message'] if result else '预约发生异常')
+            return
+        jd_seckill.timers.set_buy_time(run_at)
+        jd_seckill.running_flag = True
+        jd_seckill.seckill_by_proc_pool()
+
+    def run(self):
+        logger.info('常驻模式已启动，每日预约时间: %s，每日抢购时间: %s', self.reserve_time or '不预约', self.seckill_time)
+        while True:
+            run_at, job = self.next_job()
+            logger.info('下一个任务【%s】将在 %s 执行', job, run_at)
+            self.sleep_until(run_at - timedelta(seconds=self.prepare_time))
+            try:
+                self.refresh_stale()
+                if job == 'reserve':
+                    self.sleep_until(run_at)
+                self.run_job(job, run_at)
+            except Exception as e:
+                logger.error('任务【%s】执行异常: %s', job, e)
+            write_summary()
+            # 避免同一时间点重复执行
+            self.sleep_until(run_at + timedelta(seconds=1))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import collections
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .jd_logger import logger
+from .config import global_config
+from . import metrics
+
+# 至少积累多少个耗时样本后才开始对冲
+MIN_SAMPLES = 3
+
+
+def is_enabled():
+    return global_config.getRaw('config', 'hedge_enable', 'false') == 'true'
+
+
+class HedgedGetter(object):
+    """
+    对冲请求，只能用于幂等的只读请求（如 itemShowBtn 轮询、获取京东服务器时间）
+    请求发出后超过最近耗时的 hedge_percentile 分位仍未返回时，再发出一个相同的请求，
+    Session 连接池会为其分配另一个连接，先返回的结果被采用；
+    对冲请求数不超过总请求数的 hedge_max_ratio
+    """
+
+    def __init__(self, session, stage):
+        self.session = session
+        self.stage = stage
+        self.percentile = float(global_config.getRaw('config', 'hedge_percentile', '0.9'))
+        self.max_ratio = float(global_config.getRaw('config', 'hedge_max_ratio', '0.1'))
+        self.latencies = collections.deque(maxlen=50)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def _hedge_delay(self):
+        """
+        对冲等待时间，样本不足或超出对冲次数上限时返回None
+        """
+        with self.lock:
+            if len(self.latencies) < MIN_SAMPLES or self.hedges + 1 > self.requests * self.max_ratio:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+
+    def _timed_get(self, url, kwargs):
+        start = time.perf_counter()
+        resp = self.session.get(url, **kwargs)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return resp
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.requests += 1
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._timed_get(url, kwargs)
+
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hedge-{}'.format(self.stage))
+        first = self.pool.submit(self._timed_get, url, kwargs)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        second = self.pool.submit(self._timed_get, url, kwargs)
+        with self.lock:
+            self.hedges += 1
+        metrics.inc('jd_seckill_hedge_requests', stage=self.stage)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    resp = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is second:
+                    with self.lock:
+                        self.hedge_wins += 1
+                    metrics.inc('jd_seckill_hedge_wins', stage=self.stage)
+                return resp
+        raise error
+
+    def log_stats(self):
+        if self.hedges:
+            logger.info('阶段【%s】共请求%s次，对冲%s次，其中对冲请求先返回%s次',
+                        self.stage, self.requests, self.hedges, self.hedge_wins)
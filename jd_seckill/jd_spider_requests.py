@@ -6,30 +6,50 @@ import time
 import requests
 import functools
 import json
-import os
-import pickle
 import asyncio
+import hashlib
+import threading
 
-from lxml import etree
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from .jd_logger import logger
 from .timer import Timer
+from .poller import SeckillUrlPoller
+from .stages import StageRunner
+from .cookie_store import CookieStore
+from .clock import get_clock
+from . import metrics, journal
+from .profiling import profile_phase
+from .replay import RecordingAdapter, ReplayAdapter
+from .daemon import SeckillDaemon
+from .worker import make_snapshot, run_worker, get_mp_context
+from .hedge import HedgedGetter, is_enabled as hedge_enabled
+from .tuner import WorkerTuner, may_attempt, report_result, init_worker as tuner_init_worker
+from .scheduler import SeckillScheduler, load_seckill_tasks
+from .startup import startup_timer
+from .notifier import get_dispatcher, PRIORITY_HIGH
 from .config import global_config
 from .exception import SKException
 from .util import (
     parse_json,
-    send_wechat,
     wait_some_time,
     response_status,
-    save_image,
     open_image,
     add_bg_for_qr,
+    qrcode_show_mode,
+    print_qr_in_terminal,
+    read_json_file,
+    write_json_file,
     email
 
 )
 
 from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+# 二维码扫描结果：201 未扫描，202 已扫描待手机确认，203 已过期
+QRCODE_SCANNED = 202
+QRCODE_EXPIRED = 203
 
 
 class SpiderSession:
@@ -39,6 +59,8 @@ class SpiderSession:
 
     def __init__(self):
         self.cookies_dir_path = "cookies/"
+        self.cookie_store = CookieStore(self.cookies_dir_path)
+        self.account = None
         self.user_agent = global_config.getRaw('config', 'default_user_agent')
 
         self.session = self._init_session()
@@ -46,6 +68,21 @@ class SpiderSession:
     def _init_session(self):
         session = requests.session()
         session.headers = self.get_headers()
+        if metrics.is_enabled():
+            session.hooks['response'].append(metrics.response_hook)
+        if journal.get_journal_file():
+            session.hooks['response'].append(journal.response_hook)
+
+        replay_file = global_config.getRaw('debug', 'replay_file', '')
+        record_file = global_config.getRaw('debug', 'record_file', '')
+        if replay_file:
+            adapter = ReplayAdapter(replay_file, float(global_config.getRaw('debug', 'replay_speed', '1')))
+        elif record_file:
+            adapter = RecordingAdapter(record_file)
+        else:
+            return session
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         return session
 
     def get_headers(self):
@@ -79,33 +116,24 @@ class SpiderSession:
     def load_cookies_from_local(self):
         """
         从本地加载Cookie
+        优先加载配置的 cookie_profile 账号，未配置时加载最近保存的账号
         :return:
         """
-        cookies_file = ''
-        if not os.path.exists(self.cookies_dir_path):
-            return False
-        for name in os.listdir(self.cookies_dir_path):
-            if name.endswith(".cookies"):
-                cookies_file = '{}{}'.format(self.cookies_dir_path, name)
-                break
-        if cookies_file == '':
+        profile = global_config.getRaw('account', 'cookie_profile', '')
+        account, local_cookies = self.cookie_store.load(profile or None)
+        if local_cookies is None:
             return False
-        with open(cookies_file, 'rb') as f:
-            local_cookies = pickle.load(f)
+        self.account = account
         self.set_cookies(local_cookies)
+        return True
 
     def save_cookies_to_local(self, cookie_file_name):
         """
         保存Cookie到本地
-        :param cookie_file_name: 存放Cookie的文件名称
+        :param cookie_file_name: 用户昵称，账号无法识别时作为索引
         :return:
         """
-        cookies_file = '{}{}.cookies'.format(self.cookies_dir_path, cookie_file_name)
-        directory = os.path.dirname(cookies_file)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        with open(cookies_file, 'wb') as f:
-            pickle.dump(self.get_cookies(), f)
+        self.account = self.cookie_store.save(self.get_cookies(), cookie_file_name)
 
 
 class QrLogin:
@@ -123,12 +151,19 @@ class QrLogin:
         :param spider_session:
         """
         self.qrcode_img_file = 'qr_code.png'
+        self.qrcode_status = None
+        self.qrcode_timeout = 170
+        self.qrcode_poll_interval = 2
+        self.qrcode_confirm_interval = 0.3
+        # 校验cookie请求的超时时间，保证后台校验能在 wait_validation 的等待时间内结束；单位：秒
+        self.validate_timeout = 5
 
         self.spider_session = spider_session
         self.session = self.spider_session.get_session()
 
+        # 登录状态的校验放在预热阶段中与其他阶段并发执行
         self.is_login = False
-        self.refresh_login_status()
+        self._validation_thread = None
 
     def refresh_login_status(self):
         """
@@ -136,6 +171,75 @@ class QrLogin:
         :return:
         """
         self.is_login = self._validate_cookies()
+        self.record_validation()
+
+    def record_validation(self):
+        """
+        记录最近一次校验成功的时间，校验失败时清除
+        :return:
+        """
+        if self.spider_session.account:
+            self.spider_session.cookie_store.update(
+                self.spider_session.account, validated_at=time.time() if self.is_login else None)
+
+    def _is_validation_fresh(self):
+        """
+        最近一次校验成功在 login_check_ttl 分钟内，且登录态cookie未过期
+        :return:
+        """
+        account = self.spider_session.account
+        entry = self.spider_session.cookie_store.get_entry(account) if account else None
+        if not entry or not entry.get('validated_at'):
+            return False
+        now = time.time()
+        ttl = float(global_config.getRaw('account', 'login_check_ttl', '30')) * 60
+        if entry.get('expires') and entry['expires'] <= now:
+            return False
+        return now - entry['validated_at'] < ttl
+
+    def check_login_status(self):
+        """
+        启动时校验登录状态
+        login_check_mode：
+            probe：每次都访问订单列表页校验
+            skip：缓存的校验结果仍有效时直接认为已登录
+            background：缓存的校验结果仍有效时先认为已登录，同时在后台校验，结果通过 wait_validation 获取，
+                        预热时依赖登录的阶段会等待校验结果
+        :return:
+        """
+        mode = global_config.getRaw('account', 'login_check_mode', 'background')
+        if mode == 'probe' or not self._is_validation_fresh():
+            self.refresh_login_status()
+            return
+        logger.info('最近一次登录校验仍在有效期内，跳过启动时的登录校验')
+        self.is_login = True
+        if mode == 'background':
+            self._validation_thread = threading.Thread(
+                target=self._background_validate, name='login-check', daemon=True)
+            self._validation_thread.start()
+
+    def _background_validate(self):
+        is_login = self._validate_cookies()
+        # 等待超时后已按登录失效处理，之后返回的结果不再采用
+        if self._validation_thread is threading.current_thread():
+            self.is_login = is_login
+            self.record_validation()
+
+    def wait_validation(self, timeout=10):
+        """
+        等待后台登录校验完成
+        :return: 是否登录
+        """
+        if self._validation_thread is not None:
+            self._validation_thread.join(timeout)
+            if self._validation_thread.is_alive():
+                # 超时按校验失败处理，回到扫码登录，不带着可能失效的cookie继续执行
+                logger.info('后台登录校验超时，按登录失效处理')
+                self.is_login = False
+            elif not self.is_login:
+                logger.info('后台登录校验失败，cookie已失效')
+            self._validation_thread = None
+        return self.is_login
 
     def _validate_cookies(self):
         """
@@ -148,7 +252,7 @@ class QrLogin:
             'rid': str(int(time.time() * 1000)),
         }
         try:
-            resp = self.session.get(url=url, params=payload, allow_redirects=False)
+            resp = self.session.get(url=url, params=payload, allow_redirects=False, timeout=self.validate_timeout)
             if resp.status_code == requests.codes.OK:
                 return True
         except Exception as e:
@@ -185,12 +289,15 @@ class QrLogin:
             logger.info('获取二维码失败')
             return False
 
-        save_image(resp, self.qrcode_img_file)
+        # 邮件推送需要图片文件，两种展示方式都保留文件
+        with open(self.qrcode_img_file, 'wb') as f:
+            f.write(resp.content)
         logger.info('二维码获取成功，请打开京东APP扫描')
 
-        open_image(add_bg_for_qr(self.qrcode_img_file))
-        if global_config.getRaw('messenger', 'email_enable') == 'true':
-            email.send('二维码获取成功，请打开京东APP扫描', "<img src='cid:qr_code.png'>", [email.mail_user], 'qr_code.png')
+        if qrcode_show_mode() != 'terminal' or not print_qr_in_terminal(resp.content):
+            open_image(add_bg_for_qr(self.qrcode_img_file))
+        get_dispatcher().email('二维码获取成功，请打开京东APP扫描', "<img src='cid:qr_code.png'>", [email.mail_user],
+                               'qr_code.png', priority=PRIORITY_HIGH)
         return True
 
     def _get_qrcode_ticket(self):
@@ -216,6 +323,7 @@ class QrLogin:
             return False
 
         resp_json = parse_json(resp.text)
+        self.qrcode_status = resp_json['code']
         if resp_json['code'] != 200:
             logger.info('Code: %s, Message: %s', resp_json['code'], resp_json['msg'])
             return None
@@ -258,14 +366,21 @@ class QrLogin:
             raise SKException('二维码下载失败')
 
         # get QR code ticket
+        # 201 未扫描时按常规间隔轮询；202 已扫描待确认时缩短间隔，尽快拿到票据
+        clock = get_clock()
+        deadline = clock.time() + self.qrcode_timeout
         ticket = None
-        retry_times = 85
-        for _ in range(retry_times):
+        while clock.time() < deadline:
             ticket = self._get_qrcode_ticket()
             if ticket:
                 break
-            time.sleep(2)
-        else:
+            if self.qrcode_status == QRCODE_EXPIRED:
+                break
+            if self.qrcode_status == QRCODE_SCANNED:
+                clock.sleep(self.qrcode_confirm_interval)
+            else:
+                clock.sleep(self.qrcode_poll_interval)
+        if not ticket:
             raise SKException('二维码过期，请重新获取扫描')
 
         # validate QR code ticket
@@ -285,13 +400,83 @@ class JdTdudfp:
         self.is_init = False
         self.jd_tdudfp = None
 
+        self.cache_file = global_config.getRaw('config', 'eid_fp_cache_file', '.jd_tdudfp_cache.json')
+        # 缓存有效期；单位：小时
+        self.cache_ttl = float(global_config.getRaw('config', 'eid_fp_cache_ttl', '24')) * 3600
+        self._refresh_lock = threading.Lock()
+
     def init_jd_tdudfp(self):
         self.is_init = True
 
-        loop = asyncio.get_event_loop()
-        get_future = asyncio.ensure_future(self._get_auto_eid_fp())
-        loop.run_until_complete(get_future)
-        self.jd_tdudfp = get_future.result()
+        if global_config.getRaw('config', 'open_auto_get_eid_fp') == 'false':
+            return
+
+        cached = self._load_cache()
+        if cached:
+            self.jd_tdudfp = cached['jd_tdudfp']
+            logger.info("从缓存读取jd_tdudfp：【%s】" % self.jd_tdudfp)
+            # 缓存超过有效期一半时在后台刷新，不阻塞抢购
+            if time.time() - cached['saved_at'] > self.cache_ttl / 2:
+                threading.Thread(target=self._refresh_cache, name='eid-fp-refresh', daemon=True).start()
+            return
+
+        self._refresh_cache()
+
+    def _refresh_cache(self):
+        """
+        启动浏览器获取 _JdTdudfp，获取成功则写入缓存
+        """
+        # 后台刷新与常驻模式的每日刷新可能同时发生，同一个userDataDir同时只能启动一个浏览器
+        with self._refresh_lock:
+            # 预热阶段在线程中执行，需要使用独立的事件循环
+            loop = asyncio.new_event_loop()
+            try:
+                jd_tdudfp = loop.run_until_complete(self._get_auto_eid_fp())
+            finally:
+                # 关闭事件循环前取消pyppeteer遗留的任务
+                pending = asyncio.all_tasks(loop)
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.close()
+        if self._is_valid(jd_tdudfp):
+            self.jd_tdudfp = jd_tdudfp
+            self._save_cache(jd_tdudfp)
+        elif self.jd_tdudfp is None:
+            self.jd_tdudfp = jd_tdudfp
+
+    def _cache_key(self):
+        """
+        缓存按账号及UserAgent区分
+        """
+        try:
+            pin = self.cookies.get('pt_pin') or ''
+        except Exception:
+            pin = ''
+        return '{}|{}'.format(pin, hashlib.md5(self.user_agent.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _is_valid(jd_tdudfp):
+        return isinstance(jd_tdudfp, dict) and bool(jd_tdudfp.get('eid')) and bool(jd_tdudfp.get('fp'))
+
+    def _load_cache(self):
+        entry = read_json_file(self.cache_file, {}).get(self._cache_key())
+        if not entry or not self._is_valid(entry.get('jd_tdudfp')):
+            return None
+        if time.time() - entry.get('saved_at', 0) > self.cache_ttl:
+            logger.info('jd_tdudfp缓存已过期')
+            return None
+        return entry
+
+    def _save_cache(self, jd_tdudfp):
+        cache = read_json_file(self.cache_file, {})
+        cache[self._cache_key()] = {'jd_tdudfp': jd_tdudfp, 'saved_at': time.time()}
+        try:
+            write_json_file(self.cache_file, cache)
+        except OSError as e:
+            logger.info('jd_tdudfp缓存写入失败: %s', e)
 
     def get(self, key):
         return self.jd_tdudfp.get(key) if self.jd_tdudfp else None
@@ -299,6 +484,7 @@ class JdTdudfp:
     async def _get_auto_eid_fp(self):
 
         jd_tdudfp = None
+        browser = None
         try:
             # 是否开启自动获取eid和fp,默认为true，开启。设置为false，请自行配置eid和fp
             open_auto_get_eid_fp = global_config.getRaw('config', 'open_auto_get_eid_fp')
@@ -306,9 +492,11 @@ class JdTdudfp:
                 # 如果配置false，直接返回false
                 return jd_tdudfp
 
-            from pyppeteer import launch
+            launch = startup_timer.lazy_import('pyppeteer').launch
             url = "https://www.jd.com/"
+            # 非主线程中无法注册信号处理函数
             browser = await launch(userDataDir=".user_data", autoClose=True,
+                                   handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False,
                                    args=['--start-maximized', '--no-sandbox', '--disable-setuid-sandbox'])
             page = await browser.newPage()
             # 有些页面打开慢，这里设置时间长一点，360秒
@@ -365,10 +553,20 @@ class JdTdudfp:
             await page.close()
         except Exception as e:
             logger.info("自动获取JdTdudfp发生异常，将从配置文件读取！")
+        finally:
+            # 每次获取后关闭浏览器，否则浏览器进程一直占用userDataDir，之后的刷新无法再启动
+            if browser is not None:
+                try:
+                    await browser.close()
+                except Exception as e:
+                    logger.info('关闭浏览器失败: %s', e)
         return jd_tdudfp
 
 
 class JdSeckill(object):
+    # 依赖登录的预热阶段
+    LOGIN_DEPENDENT_STAGES = ('eid_fp', 'username', 'order_profile')
+
     def __init__(self):
         self.spider_session = SpiderSession()
         self.spider_session.load_cookies_from_local()
@@ -378,17 +576,80 @@ class JdSeckill(object):
 
         # 初始化信息
         self.sku_id = global_config.getRaw('config', 'sku_id')
-        self.seckill_num = 2
+        # 抢购开始后的运行时间；单位：分钟
+        self.continue_time = int(global_config.getRaw('config', 'continue_time'))
+        # 每次抢购的数量
+        self.seckill_num = int(global_config.getRaw('config', 'seckill_num', '') or 2)
         self.seckill_init_info = dict()
         self.seckill_url = dict()
         self.seckill_order_data = dict()
-        self.timers = Timer()
+        # 预热时准备好的提交订单请求体，key为(商品id, 数量)，抢购开始后第一次下单使用
+        self.order_bodies = dict()
+        self.order_body_used = set()
+        # 预约等不需要计时的功能不创建Timer
+        self._timers = None
 
         self.session = self.spider_session.get_session()
         self.user_agent = self.spider_session.user_agent
         self.nick_name = None
+        self.sku_title = None
+
+        # 已完成的预热阶段
+        self.warmed_stages = set()
 
         self.running_flag = True
+        self.worker_id = 0
+        # 轮询抢购链接的对冲请求
+        self.seckill_url_hedger = HedgedGetter(self.session, 'seckill_url') if hedge_enabled() else None
+        # 抢购子进程中由快照直接给出的eid和fp
+        self.eid_fp = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        根据 worker.make_snapshot 生成的数据创建只包含抢购所需属性的JdSeckill，
+        不创建QrLogin、JdTdudfp，也不加载本地cookie
+        """
+        self = cls.__new__(cls)
+        self.spider_session = SpiderSession()
+        self.session = self.spider_session.get_session()
+        self.session.headers.update(snapshot['headers'])
+        for cookie in snapshot['cookies']:
+            self.session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+        self.qrlogin = None
+        self.jd_tdufp = None
+
+        self.sku_id = snapshot['sku_id']
+        self.continue_time = snapshot['continue_time']
+        self.seckill_num = snapshot['seckill_num']
+        self.seckill_init_info = dict()
+        self.seckill_url = dict()
+        self.seckill_order_data = dict()
+        self.order_bodies = dict(snapshot['order_bodies'])
+        self.order_body_used = set()
+        self._timers = Timer(sync=False, buy_time=snapshot['buy_time'], session=self.session)
+        self._timers.diff_time = snapshot['diff_time']
+        self._timers.diff_error = snapshot['diff_error']
+        if hedge_enabled():
+            self._timers.hedger = HedgedGetter(self.session, 'jd_time')
+
+        self.user_agent = snapshot['user_agent']
+        self.nick_name = snapshot['nick_name']
+        self.sku_title = snapshot['sku_title']
+        self.warmed_stages = set()
+        self.running_flag = True
+        self.worker_id = 0
+        self.seckill_url_hedger = HedgedGetter(self.session, 'seckill_url') if hedge_enabled() else None
+        self.eid_fp = tuple(snapshot['eid_fp'])
+        return self
+
+    @property
+    def timers(self):
+        if self._timers is None:
+            self._timers = Timer(sync=False, session=self.session)
+            if hedge_enabled():
+                self._timers.hedger = HedgedGetter(self.session, 'jd_time')
+        return self._timers
 
     def login_by_qrcode(self):
         """
@@ -404,77 +665,213 @@ class JdSeckill(object):
         if self.qrlogin.is_login:
             self.nick_name = self.get_username()
             self.spider_session.save_cookies_to_local(self.nick_name)
+            self.qrlogin.record_validation()
         else:
             raise SKException("二维码登录失败！")
 
-    def check_login_and_jdtdufp(func):
+    def _warm_up_login(self):
+        self.qrlogin.check_login_status()
+        # 后台校验与不依赖登录的阶段并发执行，依赖登录的阶段等校验结果出来后再执行，不会使用失效的cookie
+        self.qrlogin.wait_validation()
+        self.login_by_qrcode()
+
+    def reset_login_stages(self):
         """
-        用户登陆态校验装饰器。若用户未登陆，则调用扫码登陆
+        登录态失效时，清除登录及依赖登录的预热阶段，下次预热时重新执行
         """
+        for name in ('login',) + self.LOGIN_DEPENDENT_STAGES:
+            self.warmed_stages.discard(name)
+        self.jd_tdufp.is_init = False
+
+    def _warm_up_eid_fp(self):
+        if not self.jd_tdufp.is_init:
+            self.jd_tdufp.init_jd_tdudfp()
 
-        @functools.wraps(func)
-        def new_func(self, *args, **kwargs):
-            if not self.qrlogin.is_login:
-                logger.info("{0} 需登陆后调用，开始扫码登陆".format(func.__name__))
-                self.login_by_qrcode()
-            if not self.jd_tdufp.is_init:
-                self.jd_tdufp.init_jd_tdudfp()
-            return func(self, *args, **kwargs)
+    def _warm_up_username(self):
+        if not self.nick_name:
+            self.nick_name = self.get_username()
+        logger.info('用户:{}'.format(self.nick_name))
 
-        return new_func
+    def _warm_up_sku_title(self):
+        self.sku_title = self.get_sku_title()
+        logger.info('商品名称:{}'.format(self.sku_title))
 
-    @check_login_and_jdtdufp
+    def _warm_up_order_profile(self):
+        """
+        用最新的秒杀初始化信息预先编码抢购开始后第一次下单的请求体，只保存在内存中，按商品和数量区分；
+        获取不到初始化信息时（通常是抢购开始前）不准备，下单时按正常流程获取
+        """
+        key = (self.sku_id, self.seckill_num)
+        self.order_bodies.pop(key, None)
+        try:
+            init_info = self._get_seckill_init_info()
+            body = urlencode(self._build_seckill_order_data(init_info))
+        except Exception as e:
+            logger.info('获取秒杀初始化信息失败，下单时再获取：%s', e)
+            return
+        self.order_bodies[key] = body
+
+    def warm_up(self, targets=None):
+        """
+        执行抢购前的预热阶段，互不依赖的阶段并发执行
+            login：校验cookies，失效则扫码登录
+            timer：同步京东服务器时间
+            eid_fp：获取eid和fp，依赖登录
+            username：获取用户昵称，依赖登录
+            sku_title：获取商品名称
+            order_profile：按抢购数量预先生成第一次下单的请求体，依赖登录和eid/fp
+        :param targets: 需要完成的阶段，None表示全部
+        :return:
+        """
+        runner = StageRunner()
+        runner.add('login', self._warm_up_login)
+        runner.add('timer', lambda: self.timers.sync_time())
+        runner.add('eid_fp', self._warm_up_eid_fp, deps=('login',))
+        runner.add('username', self._warm_up_username, deps=('login',))
+        runner.add('sku_title', self._warm_up_sku_title)
+        runner.add('order_profile', self._warm_up_order_profile, deps=('login', 'eid_fp'))
+        with profile_phase('warmup'):
+            runner.run(targets, done=self.warmed_stages)
+        startup_timer.mark('预热')
+        startup_timer.report()
+
+    def check_login_and_jdtdufp(*targets):
+        """
+        预热校验装饰器。执行前完成登录、eid/fp等预热阶段，已完成的阶段不会重复执行
+        :param targets: 被装饰方法需要的预热阶段
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def new_func(self, *args, **kwargs):
+                if not self.qrlogin.is_login:
+                    self.reset_login_stages()
+                self.warm_up(targets)
+                return func(self, *args, **kwargs)
+
+            return new_func
+
+        return decorator
+
+    @check_login_and_jdtdufp('login', 'eid_fp')
     def reserve(self):
         """
         预约
+        :return: 预约结果dict，发生异常时返回None
+        """
+        return self._reserve()
+
+    @check_login_and_jdtdufp('login')
+    def reserve_by_thread_pool(self):
         """
-        self._reserve()
+        批量预约
+        reserve_sku_ids：需要预约的商品id，英文逗号分隔，留空则预约配置的sku_id
+        """
+        sku_ids = [sku_id.strip() for sku_id in
+                   global_config.getRaw('config', 'reserve_sku_ids', '').split(',') if sku_id.strip()]
+        try:
+            self.reserve_skus(sku_ids or [self.sku_id],
+                              with_title=global_config.getRaw('config', 'reserve_with_title', 'false') == 'true')
+        finally:
+            get_dispatcher().flush()
 
-    @check_login_and_jdtdufp
-    def seckill(self):
+    @check_login_and_jdtdufp('login', 'eid_fp', 'timer', 'username', 'sku_title', 'order_profile')
+    def seckill(self, worker_id=0):
         """
         抢购
+        :param worker_id: 进程编号，自动调整进程数量时用于判断是否轮到该进程下单
         """
-        self._seckill()
+        self.run_seckill(worker_id)
 
-    @check_login_and_jdtdufp
+    def run_seckill(self, worker_id=0):
+        """
+        不经过预热校验直接抢购，抢购子进程的入口
+        :param worker_id: 进程编号
+        """
+        self.worker_id = worker_id
+        try:
+            self._seckill()
+        finally:
+            # 进程池的子进程退出时不会执行atexit，这里主动发送剩余消息
+            get_dispatcher().flush()
+
+    @check_login_and_jdtdufp('login', 'eid_fp', 'timer', 'username', 'sku_title', 'order_profile')
     def seckill_by_proc_pool(self):
         """
         多进程进行抢购
         work_count：进程数量
         """
-        # 增加进程配置
-        work_count = int(global_config.getRaw('config', 'work_count'))
-        with ProcessPoolExecutor(work_count) as pool:
-            for i in range(work_count):
-                pool.submit(self.seckill)
+        # 子进程只接收抢购所需的最小数据，不传递整个JdSeckill
+        snapshot = make_snapshot(self)
+        # 增加进程配置，auto 为根据往返耗时和下单返回码自动调整
+        work_count = global_config.getRaw('config', 'work_count')
+        if work_count != 'auto':
+            work_count = int(work_count)
+            with ProcessPoolExecutor(work_count, mp_context=get_mp_context()) as pool:
+                for i in range(work_count):
+                    pool.submit(run_worker, snapshot, i)
+            return
+
+        tuner = WorkerTuner()
+        tuner.start(self.session)
+        try:
+            with ProcessPoolExecutor(tuner.max_workers, mp_context=get_mp_context(),
+                                     initializer=tuner_init_worker, initargs=tuner.initargs()) as pool:
+                for i in range(tuner.max_workers):
+                    pool.submit(run_worker, snapshot, i)
+        finally:
+            tuner.stop()
+
+    @check_login_and_jdtdufp('login', 'eid_fp', 'timer', 'username')
+    def seckill_by_schedule(self):
+        """
+        单进程按抢购时间依次抢购多个商品
+        seckill_tasks：商品id|抢购时间|运行时间，多个任务用英文分号分隔
+        """
+        try:
+            SeckillScheduler(self, load_seckill_tasks()).run()
+        finally:
+            get_dispatcher().flush()
+
+    def run_daemon(self):
+        """
+        常驻模式，按每日计划执行预约和抢购
+        """
+        SeckillDaemon(self).run()
 
     def _reserve(self):
         """
-        预约
+        预约，重试与退避在 make_reserve 内完成，这里只执行一次
+        :return: 预约结果dict，发生异常时返回None
         """
-        while True:
-            try:
-                self.make_reserve()
-                break
-            except Exception as e:
-                logger.info('预约发生异常!', e)
-            wait_some_time()
+        try:
+            return self.make_reserve()
+        except Exception as e:
+            logger.info('预约发生异常! %s', e)
+            return None
 
     def _seckill(self):
         """
         抢购
         """
+        with profile_phase('hot', self.sku_id):
+            self._seckill_loop()
+
+    def _seckill_loop(self):
         while self.running_flag:
             self.seckill_canstill_running()
             try:
                 self.request_seckill_url()
                 while self.running_flag:
-                    self.request_seckill_checkout_page()
-                    self.submit_seckill_order()
+                    if not may_attempt(self.worker_id):
+                        # 未轮到该进程下单
+                        get_clock().sleep(0.05)
+                    else:
+                        self.request_seckill_checkout_page()
+                        self.submit_seckill_order()
                     self.seckill_canstill_running()
             except Exception as e:
-                logger.info('抢购发生异常，稍后继续执行！', e)
+                logger.info('抢购发生异常，稍后继续执行！%s', e)
             wait_some_time()
 
     def seckill_canstill_running(self):
@@ -482,43 +879,94 @@ class JdSeckill(object):
             来判断抢购的任务是否可以继续运行
         """
         buy_time = self.timers.buytime_get()
-        continue_time = int(global_config.getRaw('config', 'continue_time'))
         stop_time = datetime.strptime(
-            (buy_time + timedelta(minutes=continue_time)).strftime("%Y-%m-%d %H:%M:%S.%f"),
+            (buy_time + timedelta(minutes=self.continue_time)).strftime("%Y-%m-%d %H:%M:%S.%f"),
             "%Y-%m-%d %H:%M:%S.%f"
         )
-        current_time = datetime.now()
+        current_time = get_clock().now()
         if current_time > stop_time:
             self.running_flag = False
             logger.info('超过允许的运行时间，任务结束。')
 
-    def make_reserve(self):
-        """商品预约"""
-        logger.info('商品名称:{}'.format(self.get_sku_title()))
+    def make_reserve(self, sku_id=None, with_title=True, notify=True):
+        """商品预约
+        获取预约链接后访问，失败时按指数退避重试 reserve_retry_times 次
+        :param sku_id: 商品id，为空时使用配置的sku_id
+        :param with_title: 是否获取并输出商品名称
+        :param notify: 预约成功后是否推送消息
+        :return: 预约结果dict：sku_id、title、success、message、attempts、elapsed
+        """
+        sku_id = sku_id or self.sku_id
+        begin = time.time()
+        result = {'sku_id': sku_id, 'title': '', 'success': False, 'message': '', 'attempts': 0, 'elapsed': 0}
+        if with_title:
+            result['title'] = self.get_sku_title(sku_id)
+            logger.info('商品名称:{}'.format(result['title']))
         url = 'https://yushou.jd.com/youshouinfo.action?'
-        payload = {
-            'callback': 'fetchJSON',
-            'sku': self.sku_id,
-            '_': str(int(time.time() * 1000)),
-        }
         headers = {
             'User-Agent': self.user_agent,
-            'Referer': 'https://item.jd.com/{}.html'.format(self.sku_id),
+            'Referer': 'https://item.jd.com/{}.html'.format(sku_id),
         }
-        resp = self.session.get(url=url, params=payload, headers=headers)
-        resp_json = parse_json(resp.text)
-        reserve_url = resp_json.get('url')
-
-        while True:
+        retry_times = int(global_config.getRaw('config', 'reserve_retry_times', '5'))
+        delay = 0.2
+        for attempt in range(1, retry_times + 1):
+            result['attempts'] = attempt
             try:
-                self.session.get(url='https:' + reserve_url)
-                logger.info('预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约')
-                if global_config.getRaw('messenger', 'server_chan_enable') == 'true':
-                    success_message = "预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约"
-                    send_wechat(success_message)
+                payload = {
+                    'callback': 'fetchJSON',
+                    'sku': sku_id,
+                    '_': str(int(time.time() * 1000)),
+                }
+                resp = self.session.get(url=url, params=payload, headers=headers)
+                resp_json = parse_json(resp.text)
+                reserve_url = resp_json.get('url')
+                if not reserve_url:
+                    # 没有预约链接通常是商品不在预约期，重试没有意义
+                    result['message'] = '没有获取到预约链接:{}'.format(resp.text[0: 128])
+                    break
+                self.session.get(url='https:' + reserve_url, headers=headers)
+                result['success'] = True
+                result['message'] = '预约成功，已获得抢购资格 / 您已成功预约过了，无需重复预约'
                 break
             except Exception as e:
-                logger.error('预约失败正在重试...')
+                result['message'] = '预约失败:{}'.format(e)
+                if attempt == retry_times:
+                    break
+                logger.error('商品【%s】预约失败，%.1f秒后重试...', sku_id, delay)
+                get_clock().sleep(delay)
+                delay = min(delay * 2, 3)
+
+        result['elapsed'] = time.time() - begin
+        logger.info('商品【%s】%s', sku_id, result['message'])
+        if result['success'] and notify:
+            get_dispatcher().success(result['message'])
+        return result
+
+    def reserve_skus(self, sku_ids, with_title=False):
+        """
+        使用线程池并发预约多个商品
+        :param sku_ids: 商品id列表
+        :param with_title: 是否获取商品名称
+        :return: 预约结果列表，顺序与sku_ids一致
+        """
+        # 每个商品一个线程，所有商品同时预约，线程数不超过 reserve_work_count
+        work_count = max(1, min(len(sku_ids), int(global_config.getRaw('config', 'reserve_work_count', '32'))))
+        begin = time.time()
+        with ThreadPoolExecutor(work_count) as pool:
+            results = list(pool.map(
+                lambda sku_id: self.make_reserve(sku_id, with_title=with_title, notify=False), sku_ids))
+
+        logger.info('批量预约完成，共%s个商品，成功%s个，耗时%.2f秒', len(results),
+                    sum(1 for result in results if result['success']), time.time() - begin)
+        logger.info('%-16s %-6s %-4s %-8s %s', '商品id', '结果', '次数', '耗时(秒)', '信息')
+        for result in results:
+            logger.info('%-16s %-6s %-4s %-8.2f %s', result['sku_id'], '成功' if result['success'] else '失败',
+                        result['attempts'], result['elapsed'],
+                        ' '.join(item for item in (result['title'], result['message']) if item))
+        success_ids = [result['sku_id'] for result in results if result['success']]
+        if success_ids:
+            get_dispatcher().success('批量预约成功的商品:{}'.format(','.join(success_ids)))
+        return results
 
     def get_username(self):
         """获取用户信息"""
@@ -546,19 +994,18 @@ class JdSeckill(object):
         # jQuery2381773({"imgUrl":"//storage.360buyimg.com/i.imageUpload/xxx.jpg","lastLoginTime":"","nickName":"xxx","plusStatus":"0","realName":"xxx","userLevel":x,"userScoreVO":{"accountScore":xx,"activityScore":xx,"consumptionScore":xxxxx,"default":false,"financeScore":xxx,"pin":"xxx","riskScore":x,"totalScore":xxxxx}})
         return parse_json(resp.text).get('nickName')
 
-    def get_sku_title(self):
+    def get_sku_title(self, sku_id=None):
         """获取商品名称"""
-        url = 'https://item.jd.com/{}.html'.format(global_config.getRaw('config', 'sku_id'))
+        url = 'https://item.jd.com/{}.html'.format(sku_id or self.sku_id)
         resp = self.session.get(url).content
+        etree = startup_timer.lazy_import('lxml.etree')
         x_data = etree.HTML(resp)
         sku_title = x_data.xpath('/html/head/title/text()')
         return sku_title[0]
 
-    def get_seckill_url(self):
-        """获取商品的抢购链接
-        点击"抢购"按钮后，会有两次302跳转，最后到达订单结算页面
-        这里返回第一次跳转后的页面url，作为商品的抢购链接
-        :return: 商品的抢购链接
+    def _fetch_seckill_url(self):
+        """查询一次商品的抢购链接
+        :return: 商品的抢购链接，尚未开放时返回None
         """
         url = 'https://itemko.jd.com/itemShowBtn'
         payload = {
@@ -572,27 +1019,48 @@ class JdSeckill(object):
             'Host': 'itemko.jd.com',
             'Referer': 'https://item.jd.com/{}.html'.format(self.sku_id),
         }
-        while True:
-            resp = self.session.get(url=url, headers=headers, params=payload)
+        try:
+            getter = self.seckill_url_hedger.get if self.seckill_url_hedger else self.session.get
+            resp = getter(url, headers=headers, params=payload)
             resp_json = parse_json(resp.text)
-            if resp_json.get('url'):
-                # https://divide.jd.com/user_routing?skuId=8654289&sn=c3f4ececd8461f0e4d7267e96a91e0e0&from=pc
-                router_url = 'https:' + resp_json.get('url')
-                # https://marathon.jd.com/captcha.html?skuId=8654289&sn=c3f4ececd8461f0e4d7267e96a91e0e0&from=pc
-                seckill_url = router_url.replace(
-                    'divide', 'marathon').replace(
-                    'user_routing', 'captcha.html')
-                logger.info("抢购链接获取成功: %s", seckill_url)
-                return seckill_url
-            else:
-                logger.info("抢购链接获取失败，稍后自动重试")
-                wait_some_time()
+        except Exception as e:
+            logger.info('查询抢购链接发生异常: %s', e)
+            return None
+        if not resp_json.get('url'):
+            return None
+        # https://divide.jd.com/user_routing?skuId=8654289&sn=c3f4ececd8461f0e4d7267e96a91e0e0&from=pc
+        router_url = 'https:' + resp_json.get('url')
+        # https://marathon.jd.com/captcha.html?skuId=8654289&sn=c3f4ececd8461f0e4d7267e96a91e0e0&from=pc
+        return router_url.replace(
+            'divide', 'marathon').replace(
+            'user_routing', 'captcha.html')
+
+    def get_seckill_url(self):
+        """获取商品的抢购链接
+        点击"抢购"按钮后，会有两次302跳转，最后到达订单结算页面
+        这里返回第一次跳转后的页面url，作为商品的抢购链接
+        轮询节奏由 SeckillUrlPoller 控制：开抢前少量提前，开抢前后密集轮询，之后逐步退避
+        :return: 商品的抢购链接
+        """
+        poller = SeckillUrlPoller(self.timers, self._fetch_seckill_url,
+                                  deadline_ms=self.timers.buy_time_ms + self.continue_time * 60 * 1000)
+        journal.record('seckill_start', sku_id=self.sku_id, buy_time_ms=self.timers.buy_time_ms)
+        seckill_url = poller.poll()
+        journal.record('seckill_url_found' if seckill_url else 'seckill_url_timeout',
+                       sku_id=self.sku_id, polls=poller.poll_count)
+        if self.seckill_url_hedger:
+            self.seckill_url_hedger.log_stats()
+        if not seckill_url:
+            raise SKException('抢购链接获取失败')
+        logger.info("抢购链接获取成功: %s", seckill_url)
+        return seckill_url
 
     def request_seckill_url(self):
         """访问商品的抢购链接（用于设置cookie等"""
-        logger.info('用户:{}'.format(self.get_username()))
-        logger.info('商品名称:{}'.format(self.get_sku_title()))
-        self.timers.start()
+        logger.info('用户:{}，商品名称:{}'.format(self.nick_name, self.sku_title))
+        logger.info('正在等待到达设定时间:{}，检测本地时间与京东服务器时间误差为【{}】毫秒'.format(
+            self.timers.buy_time, self.timers.diff_time))
+        # 获取到链接后直接访问，不再经过 Timer.start 的等待
         self.seckill_url[self.sku_id] = self.get_seckill_url()
         logger.info('访问商品的抢购连接...')
         headers = {
@@ -647,6 +1115,22 @@ class JdSeckill(object):
 
         return resp_json
 
+    def get_eid_fp(self):
+        """获取下单使用的eid和fp
+        :return: (eid, fp)
+        """
+        if self.eid_fp:
+            return self.eid_fp
+        open_auto_get_eid_fp = global_config.getRaw('config', 'open_auto_get_eid_fp')
+        if open_auto_get_eid_fp == 'true':
+            eid = self.jd_tdufp.get("eid") if self.jd_tdufp.get("eid") else global_config.getRaw('config', 'eid')
+            fp = self.jd_tdufp.get("fp") if self.jd_tdufp.get("fp") else global_config.getRaw('config', 'fp')
+        else:
+            # 直接取配置的
+            eid = global_config.getRaw('config', 'eid')
+            fp = global_config.getRaw('config', 'fp')
+        return eid, fp
+
     def _get_seckill_order_data(self):
         """生成提交抢购订单所需的请求体参数
         :return: 请求体参数组成的dict
@@ -654,21 +1138,20 @@ class JdSeckill(object):
         logger.info('生成提交抢购订单所需参数...')
         # 获取用户秒杀初始化信息
         self.seckill_init_info[self.sku_id] = self._get_seckill_init_info()
-        init_info = self.seckill_init_info.get(self.sku_id)
+        data = self._build_seckill_order_data(self.seckill_init_info.get(self.sku_id))
+        logger.info("order_date：%s", data)
+        return data
+
+    def _build_seckill_order_data(self, init_info):
+        """根据秒杀初始化信息生成提交抢购订单的请求体参数
+        :param init_info: 秒杀初始化信息
+        :return: 请求体参数组成的dict
+        """
         default_address = init_info.get('address') # 默认地址dict
         invoice_info = init_info.get('invoiceInfo', {})  # 默认发票信息dict, 有可能不返回
         token = init_info['token']
 
-        eid = None
-        fp = None
-        open_auto_get_eid_fp = global_config.getRaw('config', 'open_auto_get_eid_fp')
-        if open_auto_get_eid_fp == 'true':
-            eid = self.jd_tdufp.get("eid") if self.jd_tdufp.get("eid") else global_config.getRaw('config', 'eid')
-            fp = self.jd_tdufp.get("fp") if self.jd_tdufp.get("fp") else global_config.getRaw('config', 'fp')
-        else:
-            # 直接取配置的
-            eid = global_config.getRaw('config', 'eid')
-            fp = global_config.getRaw('config', 'fp')
+        eid, fp = self.get_eid_fp()
         data = {
             'skuId': self.sku_id,
             'num': self.seckill_num,
@@ -704,40 +1187,63 @@ class JdSeckill(object):
             'token': token,
             'pru': ''
         }
-        logger.info("order_date：%s", data)
         return data
 
     def submit_seckill_order(self):
         """提交抢购（秒杀）订单
+        抢购开始后第一次下单使用预热时准备好的请求体，失败后再按正常流程获取初始化信息重新下单
         :return: 抢购结果 True/False
         """
-        url = 'https://marathon.jd.com/seckillnew/orderService/pc/submitOrder.action'
-        payload = {
-            'skuId': self.sku_id,
-        }
+        key = (self.sku_id, self.seckill_num)
+        order_body = self.order_bodies.get(key)
+        if order_body and key not in self.order_body_used:
+            self.order_body_used.add(key)
+            logger.info('使用预先准备的下单参数提交抢购订单...')
+            headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
+            if self._post_seckill_order(order_body, headers, notify_failure=False):
+                return True
+            logger.info('使用预先准备的下单参数下单失败，重新获取生成订单的基本信息')
+
         try:
             self.seckill_order_data[self.sku_id] = self._get_seckill_order_data()
         except Exception as e:
             logger.info('抢购失败，无法获取生成订单的基本信息，接口返回:【{}】'.format(str(e)))
             return False
+        return self._post_seckill_order(self.seckill_order_data.get(self.sku_id))
 
+    def _post_seckill_order(self, data, extra_headers=None, notify_failure=True):
+        """发送提交订单请求并处理结果
+        :param data: 请求体，dict 或预先编码好的字符串
+        :param extra_headers: 附加的请求头
+        :param notify_failure: 失败时是否推送消息
+        :return: 抢购结果 True/False
+        """
+        url = 'https://marathon.jd.com/seckillnew/orderService/pc/submitOrder.action'
+        payload = {
+            'skuId': self.sku_id,
+        }
         logger.info('提交抢购订单...')
-        # 修改设置请求头的方式
-        self.session.headers['User-Agent'] = self.user_agent
-        self.session.headers['Host'] = 'marathon.jd.com'
-        self.session.headers[
-            'Referer'] = 'https://marathon.jd.com/seckill/seckill.action?skuId={0}&num={1}&rid={2}'.format(
-            self.sku_id, self.seckill_num, int(time.time()))
+        # 请求头随请求传入，不修改共用Session的请求头，多个商品同时抢购时互不影响
+        headers = {
+            'User-Agent': self.user_agent,
+            'Host': 'marathon.jd.com',
+            'Referer': 'https://marathon.jd.com/seckill/seckill.action?skuId={0}&num={1}&rid={2}'.format(
+                self.sku_id, self.seckill_num, int(time.time())),
+        }
+        headers.update(extra_headers or {})
         # 防止重定向，增加allow_redirects=False，20210107
         resp = self.session.post(
             url=url,
             params=payload,
-            data=self.seckill_order_data.get(
-                self.sku_id),
+            data=data,
+            headers=headers,
             allow_redirects=False)
         try:
             # 解析json
             resp_json = parse_json(resp.text)
+            metrics.inc('jd_seckill_submit_results', code=str(resp_json.get('resultCode')))
+            journal.record('submit_result', resp_json.get('resultCode'), sku_id=self.sku_id)
+            report_result(resp_json.get('resultCode'))
             # 返回信息
             # 抢购失败：
             # {'errorMessage': '很遗憾没有抢到，再接再厉哦。', 'orderId': 0, 'resultCode': 60074, 'skuId': 0, 'success': False}
@@ -750,16 +1256,14 @@ class JdSeckill(object):
                 total_money = resp_json.get('totalMoney')
                 pay_url = 'https:' + resp_json.get('pcUrl')
                 logger.info('抢购成功，订单号:{}, 总价:{}, 电脑端付款链接:{}'.format(order_id, total_money, pay_url))
-                if global_config.getRaw('messenger', 'server_chan_enable') == 'true':
-                    success_message = "抢购成功，订单号:{}, 总价:{}, 电脑端付款链接:{}".format(order_id, total_money, pay_url)
-                    send_wechat(success_message)
-                    self.running_flag = False
+                get_dispatcher().success(
+                    "抢购成功，订单号:{}, 总价:{}, 电脑端付款链接:{}".format(order_id, total_money, pay_url))
+                self.running_flag = False
                 return True
             else:
                 logger.info('抢购失败，返回信息:{}'.format(resp_json))
-                if global_config.getRaw('messenger', 'server_chan_enable') == 'true':
-                    error_message = '抢购失败，返回信息:{}'.format(resp_json)
-                    send_wechat(error_message)
+                if notify_failure:
+                    get_dispatcher().failure('抢购失败，返回信息:{}'.format(resp_json))
                 return False
         except Exception as e:
             logger.info('抢购失败，返回信息:{}'.format(resp.text[0: 128]))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import json
+import os
+import time
+
+from datetime import datetime
+
+from .config import global_config
+from .util import get_stage
+from .clock import get_clock
+
+# 本次运行的编号，通过环境变量传递给抢购子进程
+RUN_ID_ENV = 'JD_SECKILL_RUN_ID'
+# 从抢购开始到下单的各阶段，按先后顺序
+HOT_STAGES = ('seckill_url', 'seckill_page', 'checkout', 'init', 'submit')
+
+_fd = None
+_fd_pid = None
+
+
+def get_journal_file():
+    return global_config.getRaw('config', 'journal_file', '')
+
+
+def get_run_id():
+    run_id = os.environ.get(RUN_ID_ENV)
+    if not run_id:
+        run_id = new_run()
+    return run_id
+
+
+def new_run():
+    """
+    开始新的一次运行，之后的记录使用新的运行编号
+    """
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    os.environ[RUN_ID_ENV] = run_id
+    return run_id
+
+
+def record(stage, code=None, latency=None, **extra):
+    """
+    追加一条记录，未配置 journal_file 时不做任何事
+    每条记录一次 write 写入以追加方式打开的文件，多个进程同时写入不会交错
+    :param stage: 阶段或事件名称
+    :param code: 状态码或下单返回码
+    :param latency: 耗时；单位：秒
+    :param extra: 其他字段
+    :return:
+    """
+    global _fd, _fd_pid
+    journal_file = get_journal_file()
+    if not journal_file:
+        return
+    if _fd is None or _fd_pid != os.getpid():
+        directory = os.path.dirname(journal_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        _fd = os.open(journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        _fd_pid = os.getpid()
+    item = {
+        'run': get_run_id(),
+        't': time.monotonic(),
+        # 与Timer使用同一时钟，模拟时钟、回放运行的记录也能与抢购时间对比
+        'wall': get_clock().time(),
+        'worker': os.getpid(),
+        'stage': stage,
+        'code': code,
+        'latency': latency,
+    }
+    item.update(extra)
+    os.write(_fd, (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+def response_hook(resp, *args, **kwargs):
+    """
+    requests 响应钩子：每个请求记录阶段、状态码和耗时
+    """
+    record(get_stage(resp.url), resp.status_code, resp.elapsed.total_seconds())
+
+
+def load(journal_file):
+    """
+    读取所有记录，按运行编号分组
+    :return: {运行编号: [记录]}，记录按时间排序
+    """
+    runs = dict()
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            runs.setdefault(item['run'], []).append(item)
+    for items in runs.values():
+        items.sort(key=lambda item: item['t'])
+    return runs
+
+
+def _jd_offset(items):
+    """
+    计算每条记录相对抢购时间的毫秒数所需的参数：抢购时间、本地与京东服务器时间差
+    """
+    buy_time_ms = next((item['buy_time_ms'] for item in items if item['stage'] == 'seckill_start'), None)
+    diff_time = next((item['diff_time'] for item in reversed(items) if item['stage'] == 'clock_sync'), 0)
+    return buy_time_ms, diff_time
+
+
+def summarize(items):
+    """
+    统计一次运行：从抢购时间到获取链接、首次下单、最后一次下单的耗时，各阶段请求耗时，最终下单结果
+    """
+    buy_time_ms, diff_time = _jd_offset(items)
+
+    def since_buy(item):
+        if buy_time_ms is None:
+            return None
+        return item['wall'] * 1000 - diff_time - buy_time_ms
+
+    found = next((item for item in items if item['stage'] == 'seckill_url_found'), None)
+    submits = [item for item in items if item['stage'] == 'submit_result']
+    stages = dict()
+    for item in items:
+        if item['stage'] in HOT_STAGES and item.get('latency') is not None:
+            stages.setdefault(item['stage'], []).append(item['latency'])
+    return {
+        'start': datetime.fromtimestamp(items[0]['wall']).strftime('%Y-%m-%d %H:%M:%S'),
+        'records': len(items),
+        'workers': len(set(item['worker'] for item in items)),
+        'url_found_ms': since_buy(found) if found else None,
+        'first_submit_ms': since_buy(submits[0]) if submits else None,
+        'last_submit_ms': since_buy(submits[-1]) if submits else None,
+        'submits': len(submits),
+        'result': submits[-1]['code'] if submits else None,
+        'stages': stages,
+    }
+
+
+def _fmt(value):
+    return '-' if value is None else '{:.0f}'.format(value)
+
+
+def analyze(run=None, compare=5):
+    """
+    事后分析：重建一次运行的时间线，输出从抢购时间到最后一次下单之间各阶段的耗时，并与之前的运行对比
+    :param run: 运行编号，为空时分析最近一次
+    :param compare: 对比之前多少次运行
+    :return:
+    """
+    journal_file = get_journal_file()
+    if not journal_file or not os.path.exists(journal_file):
+        print('没有运行记录，请配置 journal_file')
+        return
+    runs = load(journal_file)
+    run_ids = sorted(runs)
+    run = run or run_ids[-1]
+    if run not in runs:
+        print('没有找到运行记录: {}'.format(run))
+        return
+    items = runs[run]
+    buy_time_ms, diff_time = _jd_offset(items)
+
+    print('运行 {} 的时间线（相对抢购时间，单位：毫秒）'.format(run))
+    for item in items:
+        if item['stage'] not in HOT_STAGES and item['stage'] not in ('seckill_start', 'seckill_url_found',
+                                                                       'submit_result', 'clock_sync'):
+            continue
+        offset = item['wall'] * 1000 - diff_time - buy_time_ms if buy_time_ms is not None else None
+        latency = '' if item.get('latency') is None else '{:.0f}ms'.format(item['latency'] * 1000)
+        print('{:>10} worker={:<7} {:<18} code={:<8} {}'.format(
+            _fmt(offset), item['worker'], item['stage'], str(item.get('code')), latency))
+
+    summary = summarize(items)
+    print('\n阶段耗时（单位：毫秒）')
+    print('{:<14} {:>6} {:>8} {:>8} {:>8}'.format('阶段', '次数', '合计', '中位数', '最大'))
+    for stage in HOT_STAGES:
+        latencies = sorted(summary['stages'].get(stage, []))
+        if not latencies:
+            continue
+        print('{:<14} {:>6} {:>8.0f} {:>8.0f} {:>8.0f}'.format(
+            stage, len(latencies), sum(latencies) * 1000, latencies[len(latencies) // 2] * 1000,
+            latencies[-1] * 1000))
+    print('\n抢购时间 -> 获取链接: {}ms，-> 首次下单: {}ms，-> 最后一次下单: {}ms，共下单{}次，最终返回码: {}'.format(
+        _fmt(summary['url_found_ms']), _fmt(summary['first_submit_ms']), _fmt(summary['last_submit_ms']),
+        summary['submits'], summary['result']))
+
+    previous = [run_id for run_id in run_ids if run_id < run][-compare:]
+    if previous:
+        print('\n与之前的运行对比（单位：毫秒）')
+        print('{:<16} {:<20} {:>6} {:>8} {:>10} {:>10} {:>8}'.format(
+            '运行', '开始时间', '进程数', '获取链接', '首次下单', '最后下单', '返回码'))
+        for run_id in previous + [run]:
+            other = summarize(runs[run_id])
+            print('{:<16} {:<20} {:>6} {:>8} {:>10} {:>10} {:>8}'.format(
+                run_id, other['start'], other['workers'], _fmt(other['url_found_ms']),
+                _fmt(other['first_submit_ms']), _fmt(other['last_submit_ms']), str(other['result'])))
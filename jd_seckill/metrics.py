@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import glob
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .jd_logger import logger
+from .config import global_config
+from .util import get_stage, read_json_file, write_json_file
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 超过该时间没有心跳的进程视为已退出；单位：秒
+HEARTBEAT_TIMEOUT = 5
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsRegistry(object):
+    """
+    进程内的运行指标
+    每个进程由后台线程每秒将指标快照写入 metrics_dir/<pid>.json，
+    主进程的 http 服务在抓取时合并所有进程的快照，以 worker 标签区分
+    """
+
+    def __init__(self, metrics_dir):
+        self.metrics_dir = metrics_dir
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.gauges = dict()
+        self.histograms = dict()
+        self.pools = dict()
+        self.reporter = None
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def watch_pool(self, pool):
+        """
+        记录连接池，快照时统计新建连接数与请求数，反映连接复用情况
+        """
+        host = getattr(pool, 'host', None)
+        if host and host not in self.pools:
+            with self.lock:
+                self.pools[host] = pool
+
+    def snapshot(self):
+        with self.lock:
+            for host, pool in self.pools.items():
+                self.gauges[_key('jd_seckill_pool_connections', {'host': host})] = getattr(pool, 'num_connections', 0)
+                self.gauges[_key('jd_seckill_pool_requests', {'host': host})] = getattr(pool, 'num_requests', 0)
+            return {
+                'pid': os.getpid(),
+                'heartbeat': time.time(),
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, dict(labels), value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, dict(labels)] + histogram for (name, labels), histogram in
+                               self.histograms.items()],
+            }
+
+    def start_reporter(self):
+        if self.reporter is None:
+            self.reporter = threading.Thread(target=self._report, name='metrics-reporter', daemon=True)
+            self.reporter.start()
+
+    def _report(self):
+        path = os.path.join(self.metrics_dir, '{}.json'.format(os.getpid()))
+        while True:
+            try:
+                write_json_file(path, self.snapshot())
+            except Exception as e:
+                logger.info('运行指标写入失败: %s', e)
+            time.sleep(1)
+
+
+_registry = None
+_registry_pid = None
+
+
+def is_enabled():
+    return int(global_config.getRaw('config', 'metrics_port', '0')) > 0
+
+
+def get_registry():
+    """
+    获取当前进程的指标，子进程中会重新创建；未开启时返回None
+    """
+    global _registry, _registry_pid
+    if not is_enabled():
+        return None
+    if _registry is None or _registry_pid != os.getpid():
+        _registry = MetricsRegistry(global_config.getRaw('config', 'metrics_dir', '.metrics'))
+        _registry_pid = os.getpid()
+        _registry.start_reporter()
+    return _registry
+
+
+def inc(name, value=1, **labels):
+    registry = get_registry()
+    if registry is not None:
+        registry.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    registry = get_registry()
+    if registry is not None:
+        registry.set_gauge(name, value, **labels)
+
+
+def response_hook(resp, *args, **kwargs):
+    """
+    requests 响应钩子：按阶段统计请求次数、状态码和耗时
+    """
+    registry = get_registry()
+    if registry is None:
+        return
+    stage = get_stage(resp.url)
+    registry.inc('jd_seckill_requests', stage=stage, status=str(resp.status_code))
+    registry.observe('jd_seckill_request_latency_seconds', resp.elapsed.total_seconds(), stage=stage)
+    pool = getattr(resp.raw, '_pool', None)
+    if pool is not None:
+        registry.watch_pool(pool)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+def render(metrics_dir):
+    """
+    合并所有进程的快照，生成 OpenMetrics 文本
+    """
+    families = dict()
+
+    def add(name, metric_type, line):
+        families.setdefault(name, (metric_type, []))[1].append(line)
+
+    now = time.time()
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        snapshot = read_json_file(path)
+        if not snapshot:
+            continue
+        worker = {'worker': str(snapshot['pid'])}
+        add('jd_seckill_worker_up', 'gauge', 'jd_seckill_worker_up{} {}'.format(
+            _format_labels(worker), 1 if now - snapshot['heartbeat'] < HEARTBEAT_TIMEOUT else 0))
+        add('jd_seckill_worker_heartbeat_timestamp_seconds', 'gauge',
+            'jd_seckill_worker_heartbeat_timestamp_seconds{} {}'.format(_format_labels(worker), snapshot['heartbeat']))
+        for name, labels, value in snapshot['counters']:
+            add(name, 'counter', '{}_total{} {}'.format(name, _format_labels(dict(labels, **worker)), value))
+        for name, labels, value in snapshot['gauges']:
+            add(name, 'gauge', '{}{} {}'.format(name, _format_labels(dict(labels, **worker)), value))
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            labels = dict(labels, **worker)
+            for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+                add(name, 'histogram', '{}_bucket{} {}'.format(name, _format_labels(dict(labels, le=bound)), bucket))
+            add(name, 'histogram', '{}_bucket{} {}'.format(name, _format_labels(dict(labels, le='+Inf')), count))
+            add(name, 'histogram', '{}_count{} {}'.format(name, _format_labels(labels), count))
+            add(name, 'histogram', '{}_sum{} {}'.format(name, _format_labels(labels), total))
+
+    lines = []
+    for name, (metric_type, family_lines) in sorted(families.items()):
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        lines.extend(family_lines)
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics_dir = '.metrics'
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render(self.metrics_dir).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """
+    在本机启动指标服务：http://127.0.0.1:<metrics_port>/metrics，未开启时不做任何事
+    :return:
+    """
+    if not is_enabled():
+        return None
+    port = int(global_config.getRaw('config', 'metrics_port'))
+    metrics_dir = global_config.getRaw('config', 'metrics_dir', '.metrics')
+    # 清理上次运行遗留的快照
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        os.remove(path)
+    handler = type('MetricsHandler', (_MetricsHandler,), {'metrics_dir': metrics_dir})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    get_registry()
+    logger.info('运行指标服务已启动: http://127.0.0.1:%s/metrics', port)
+    return server
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import atexit
+import itertools
+import os
+import queue
+import threading
+import time
+
+from .jd_logger import logger
+from .config import global_config
+from .util import send_wechat, email
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+
+class NotifyDispatcher(object):
+    """
+    消息推送调度器
+    推送请求进入优先级队列，由后台线程发送，抢购线程不等待网络IO
+        1、成功消息优先发送
+        2、失败消息不逐条发送，按 failure_summary_interval 秒合并为一条汇总
+    """
+
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        # 汇总只需要失败次数和最近一次的消息，不保留每条消息
+        self.failure_count = 0
+        self.last_failure = None
+        self.last_summary_time = time.time()
+        self.summary_interval = float(global_config.getRaw('messenger', 'failure_summary_interval', '60'))
+        self.worker = None
+
+    def _ensure_worker(self):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run, name='notifier', daemon=True)
+            self.worker.start()
+
+    def submit(self, func, *args, priority=PRIORITY_LOW):
+        """
+        提交推送任务
+        :param func: 推送函数，在后台线程中执行
+        :param priority: PRIORITY_HIGH 优先发送
+        :return:
+        """
+        self._ensure_worker()
+        self.queue.put((priority, next(self.sequence), func, args))
+
+    def wechat(self, message, priority=PRIORITY_LOW):
+        if global_config.getRaw('messenger', 'server_chan_enable') == 'true':
+            self.submit(send_wechat, message, priority=priority)
+
+    def email(self, title, msg, receivers, img='', priority=PRIORITY_LOW):
+        if global_config.getRaw('messenger', 'email_enable') == 'true':
+            self.submit(email.send, title, msg, receivers, img, priority=priority)
+
+    def success(self, message):
+        """成功消息，立即以高优先级推送"""
+        self.wechat(message, priority=PRIORITY_HIGH)
+
+    def failure(self, message):
+        """失败消息，累积后定期汇总推送"""
+        if global_config.getRaw('messenger', 'server_chan_enable') != 'true':
+            return
+        with self.lock:
+            self.failure_count += 1
+            self.last_failure = message
+        self._ensure_worker()
+
+    def _take_summary(self, force=False):
+        with self.lock:
+            if not self.failure_count:
+                return None
+            if not force and time.time() - self.last_summary_time < self.summary_interval:
+                return None
+            count, last_failure = self.failure_count, self.last_failure
+            self.failure_count, self.last_failure = 0, None
+            self.last_summary_time = time.time()
+        summary = '{}内共失败{}次，最近一次：{}'.format(
+            '最近{}秒'.format(int(self.summary_interval)) if not force else '本次运行', count, last_failure)
+        return summary
+
+    def _run(self):
+        while True:
+            try:
+                _, _, func, args = self.queue.get(timeout=1)
+            except queue.Empty:
+                summary = self._take_summary()
+                if summary:
+                    self._send(send_wechat, (summary,))
+                continue
+            self._send(func, args)
+            self.queue.task_done()
+
+    @staticmethod
+    def _send(func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.info('消息推送失败: %s', e)
+
+    def flush(self, timeout=10):
+        """
+        进程退出前发送剩余消息及失败汇总，最多等待 timeout 秒
+        :return:
+        """
+        summary = self._take_summary(force=True)
+        if summary:
+            self.submit(send_wechat, summary)
+        if self.worker is None:
+            return
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+
+
+_dispatcher = None
+_dispatcher_pid = None
+
+
+def get_dispatcher():
+    """
+    获取当前进程的消息推送调度器，子进程中会重新创建
+    """
+    global _dispatcher, _dispatcher_pid
+    if _dispatcher is None or _dispatcher_pid != os.getpid():
+        _dispatcher = NotifyDispatcher()
+        _dispatcher_pid = os.getpid()
+        atexit.register(_dispatcher.flush)
+    return _dispatcher
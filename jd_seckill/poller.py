@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+from .jd_logger import logger
+from .config import global_config
+from .clock import get_clock
+
+
+class SeckillUrlPoller(object):
+    """
+    抢购链接轮询调度器
+    大致流程：
+        1、在抢购时间前 lead_time 毫秒开始轮询，提前覆盖时间误差
+        2、抢购时间前后 dense_window 毫秒内按 dense_interval 密集轮询
+        3、超出密集窗口后按 backoff 倍数逐步放缓，最大不超过 max_interval
+    """
+
+    def __init__(self, timer, fetch, deadline_ms=None):
+        """
+        :param timer: Timer对象，提供京东服务器时间
+        :param fetch: 单次查询函数，返回抢购链接或None
+        :param deadline_ms: 停止轮询的京东服务器毫秒时间，None表示不限制
+        """
+        self.timer = timer
+        self.fetch = fetch
+        self.deadline_ms = deadline_ms
+
+        self.lead_time = int(global_config.getRaw('config', 'seckill_url_lead_time', '300'))
+        self.dense_window = int(global_config.getRaw('config', 'seckill_url_dense_window', '1500'))
+        self.dense_interval = int(global_config.getRaw('config', 'seckill_url_dense_interval', '20'))
+        self.max_interval = int(global_config.getRaw('config', 'seckill_url_max_interval', '300'))
+        self.backoff = 1.5
+
+        self.poll_count = 0
+        self.found_delay_ms = None
+
+    def poll(self):
+        """
+        轮询直到获取到抢购链接
+        :return: 抢购链接，超过 deadline_ms 仍未获取到时返回None
+        """
+        buy_time_ms = self.timer.buy_time_ms
+        self.timer.wait_until(buy_time_ms - self.lead_time)
+        logger.info('开始轮询抢购链接，提前量【%s】毫秒', self.lead_time)
+
+        interval = self.dense_interval
+        while True:
+            self.poll_count += 1
+            url = self.fetch()
+            now_ms = self.timer.jd_now()
+            if url:
+                self.found_delay_ms = now_ms - buy_time_ms
+                logger.info('抢购链接轮询【%s】次，开抢后【%s】毫秒获取到链接', self.poll_count, self.found_delay_ms)
+                return url
+            if self.deadline_ms is not None and now_ms >= self.deadline_ms:
+                logger.info('抢购链接轮询【%s】次，超过允许的运行时间仍未获取到链接', self.poll_count)
+                return None
+            if now_ms - buy_time_ms > self.dense_window:
+                interval = min(self.max_interval, interval * self.backoff)
+            get_clock().sleep(interval / 1000.0)
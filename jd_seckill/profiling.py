@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import contextlib
+import glob
+import io
+import os
+
+from .jd_logger import logger
+from .config import global_config
+
+# 命令行 --profile 通过环境变量传递给抢购子进程
+PROFILE_ENV = 'JD_SECKILL_PROFILE'
+
+_enabled = None
+_null_context = contextlib.nullcontext()
+
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = os.environ.get(PROFILE_ENV) == '1' or \
+                   global_config.getRaw('debug', 'profile_enable', 'false') == 'true'
+    return _enabled
+
+
+def enable():
+    global _enabled
+    os.environ[PROFILE_ENV] = '1'
+    _enabled = True
+
+
+def get_profile_dir():
+    return global_config.getRaw('debug', 'profile_dir', 'profiles')
+
+
+def reset():
+    """
+    清理上次运行的统计文件，避免合并到本次的摘要中
+    """
+    if not is_enabled():
+        return
+    for path in glob.glob(os.path.join(get_profile_dir(), '*.prof')):
+        os.remove(path)
+
+
+class PhaseProfile(object):
+    """
+    使用 cProfile 统计一个阶段的耗时，结束后写入 <profile_dir>/<阶段>-<进程号>[-<标记>].prof
+    cProfile 只统计当前线程，在线程中执行的部分需要在线程内单独使用
+    """
+
+    def __init__(self, phase, tag=None):
+        self.phase = phase
+        self.tag = tag
+        self.profile = None
+
+    def __enter__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.disable()
+        profile_dir = get_profile_dir()
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir, exist_ok=True)
+        name = '-'.join(str(item) for item in (self.phase, os.getpid(), self.tag) if item is not None)
+        self.profile.dump_stats(os.path.join(profile_dir, '{}.prof'.format(name)))
+        return False
+
+
+def profile_phase(phase, tag=None):
+    """
+    统计阶段耗时，未开启时返回空的上下文管理器，不产生额外开销
+    :param phase: 阶段名称，warmup 或 hot
+    :param tag: 同一进程内区分多个线程的标记
+    """
+    if not is_enabled():
+        return _null_context
+    return PhaseProfile(phase, tag)
+
+
+def write_summary(top_n=30):
+    """
+    按阶段合并所有进程的统计结果，写入 <profile_dir>/summary-<阶段>.txt
+    :param top_n: 输出累计耗时最高的函数数量
+    :return:
+    """
+    if not is_enabled():
+        return
+    import pstats
+    profile_dir = get_profile_dir()
+    phases = dict()
+    for path in glob.glob(os.path.join(profile_dir, '*.prof')):
+        phases.setdefault(os.path.basename(path).split('-')[0], []).append(path)
+    for phase, paths in sorted(phases.items()):
+        output = io.StringIO()
+        stats = pstats.Stats(*paths, stream=output)
+        stats.sort_stats('cumulative').print_stats(top_n)
+        summary_file = os.path.join(profile_dir, 'summary-{}.txt'.format(phase))
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            f.write(output.getvalue())
+        logger.info('阶段【%s】合并了%s个统计文件，耗时最高的%s个函数见: %s', phase, len(paths), top_n, summary_file)
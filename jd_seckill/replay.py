@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import collections
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+from datetime import timedelta
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.structures import CaseInsensitiveDict
+
+from .jd_logger import logger
+from .util import get_stage
+from .clock import get_clock
+
+REDACT_HEADERS = ('cookie', 'set-cookie', 'authorization')
+# 记录的响应体是解码后的文本，回放时不能沿用这些响应头
+SKIP_REPLAY_HEADERS = REDACT_HEADERS + ('content-length', 'content-encoding', 'transfer-encoding')
+# 请求体、响应体中需要脱敏的字段
+REDACT_FIELDS = ('password', 'eid', 'fp', 'token', 'mobile', 'mobileKey', 'name', 'addressDetail', 'email',
+                 'invoicePhone', 'invoicePhoneKey', 'ticket', 'nickName', 'realName', 'pin', 'wlfstk_smdl',
+                 'imgUrl', 'sn')
+REDACTED = '***'
+# 只在特定接口上脱敏的查询参数，如扫码登录票据
+REDACT_URL_PARAMS = {
+    'passport.jd.com/uc/qrCodeTicketValidation': ('t',),
+}
+# 按文本记录的响应类型，其余（如二维码图片）不记录响应体
+TEXT_CONTENT_TYPES = ('text/', 'json', 'javascript', 'xml', 'x-www-form-urlencoded')
+
+_json_field_re = re.compile(r'("(?:{})"\s*:\s*)("(?:[^"\\]|\\.)*"|[-\d.]+)'.format('|'.join(REDACT_FIELDS)))
+_form_field_re = re.compile(r'((?:^|[&?])(?:{})=)[^&"\s]*'.format('|'.join(REDACT_FIELDS)))
+
+
+def redact(text):
+    """
+    对json及表单格式文本中的敏感字段脱敏，保持原有结构可解析
+    """
+    if not text:
+        return text
+    text = _json_field_re.sub(lambda m: m.group(1) + '"{}"'.format(REDACTED), text)
+    return _form_field_re.sub(lambda m: m.group(1) + REDACTED, text)
+
+
+def redact_url(url):
+    """
+    对url中的敏感参数脱敏，包括特定接口上的专有参数
+    """
+    url = redact(url)
+    for path, params in REDACT_URL_PARAMS.items():
+        if path in url:
+            url = re.sub(r'((?:[&?])(?:{})=)[^&#]*'.format('|'.join(params)),
+                         lambda m: m.group(1) + REDACTED, url)
+    return url
+
+
+def _is_text(resp):
+    content_type = resp.headers.get('Content-Type', '').lower()
+    return not content_type or any(kind in content_type for kind in TEXT_CONTENT_TYPES)
+
+
+def _redact_headers(headers):
+    return {key: (REDACTED if key.lower() in REDACT_HEADERS else value) for key, value in headers.items()}
+
+
+_writers = dict()
+_writers_lock = threading.Lock()
+
+
+def _get_writer(record_file):
+    """
+    同一进程内写同一记录文件的Adapter共用一个gzip文件对象，避免交错写入损坏文件
+    """
+    path = '{}.{}.jsonl.gz'.format(record_file, os.getpid())
+    with _writers_lock:
+        if path not in _writers:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            _writers[path] = (gzip.open(path, 'at', encoding='utf-8'), threading.Lock())
+        return _writers[path]
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    记录每次请求和响应
+    每个进程写入独立的 gzip 压缩jsonl文件：<record_file>.<pid>.jsonl.gz，每行一条记录：
+        stage、method、url、请求体、开始时间、耗时、状态码、响应头、响应体，其中敏感信息已脱敏，
+        图片等二进制响应不记录响应体
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['record_file']
+
+    def __init__(self, record_file, **kwargs):
+        self.record_file = record_file
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        # Session.send 在Adapter返回后才设置 resp.elapsed，这里自行计时
+        begin = time.perf_counter()
+        resp = super().send(request, **kwargs)
+        elapsed = time.perf_counter() - begin
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        record = {
+            'stage': get_stage(request.url),
+            'method': request.method,
+            'url': redact_url(request.url),
+            'request_body': redact(body),
+            'start': start,
+            'elapsed': elapsed,
+            'status': resp.status_code,
+            'reason': resp.reason,
+            'headers': _redact_headers(resp.headers),
+            'body': redact(resp.text) if _is_text(resp) else None,
+        }
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        f, lock = _get_writer(self.record_file)
+        with lock:
+            f.write(line)
+            # 同步刷新，进程被中断时已写入的记录仍可读取
+            f.flush()
+        return resp
+
+
+def load_records(pattern):
+    """
+    读取记录文件
+    :param pattern: 记录文件路径，支持通配符；也可以是 record_file 配置值，将读取其下所有进程的记录
+    :return: 按开始时间排序的记录列表
+    """
+    paths = glob.glob(pattern) or glob.glob('{}.*.jsonl.gz'.format(pattern))
+    records = []
+    for path in paths:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    records.append(json.loads(line))
+        except (EOFError, ValueError, zlib.error):
+            # 进程中断时最后一条记录可能不完整
+            pass
+    records.sort(key=lambda record: record['start'])
+    return records
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    按记录回放响应，不访问网络
+    同一method、stage的请求按记录顺序依次返回，记录用完后重复返回最后一条；
+    speed 为回放速度倍数，按记录耗时除以 speed 等待，0表示不等待
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ['replay_file', 'speed']
+
+    def __init__(self, replay_file, speed=1.0, **kwargs):
+        self.replay_file = replay_file
+        self.speed = speed
+        super().__init__(**kwargs)
+        self._load()
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._load()
+
+    def _load(self):
+        self._lock = threading.Lock()
+        self._records = collections.defaultdict(collections.deque)
+        self._last = dict()
+        for record in load_records(self.replay_file):
+            self._records[(record['method'], record['stage'])].append(record)
+        logger.info('回放模式，已加载%s条请求记录', sum(len(queue) for queue in self._records.values()))
+
+    def send(self, request, **kwargs):
+        key = (request.method, get_stage(request.url))
+        with self._lock:
+            queue = self._records.get(key)
+            if queue:
+                record = self._last[key] = queue.popleft()
+            else:
+                record = self._last.get(key)
+        if record is None:
+            raise ConnectionError('没有可回放的记录: {} {}'.format(request.method, request.url), request=request)
+        if self.speed > 0:
+            get_clock().sleep(record['elapsed'] / self.speed)
+
+        resp = Response()
+        resp.status_code = record['status']
+        resp.reason = record.get('reason')
+        resp.headers = CaseInsensitiveDict(
+            {key: value for key, value in record['headers'].items() if key.lower() not in SKIP_REPLAY_HEADERS})
+        resp._content = (record['body'] or '').encode('utf-8')
+        resp.encoding = 'utf-8'
+        resp.url = request.url
+        resp.request = request
+        resp.elapsed = timedelta(seconds=record['elapsed'])
+        resp.connection = self
+        return resp
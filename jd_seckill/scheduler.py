@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import copy
+import heapq
+import threading
+
+from datetime import timedelta
+
+from .jd_logger import logger
+from .exception import SKException
+from .config import global_config
+from .timer import parse_buy_time
+from .clock import get_clock
+from .hedge import HedgedGetter
+
+
+class SeckillTask(object):
+    def __init__(self, sku_id, buy_time, continue_time, seckill_num):
+        """
+        :param sku_id: 商品id
+        :param buy_time: 抢购时间datetime
+        :param continue_time: 抢购开始后的运行时间；单位：分钟
+        :param seckill_num: 抢购数量
+        """
+        self.sku_id = sku_id
+        self.buy_time = buy_time
+        self.continue_time = continue_time
+        self.seckill_num = seckill_num
+
+    def __repr__(self):
+        return '{}x{}@{}'.format(self.sku_id, self.seckill_num, self.buy_time)
+
+
+def load_seckill_tasks():
+    """
+    读取抢购任务列表
+    seckill_tasks 格式：商品id|抢购时间|运行时间|抢购数量，多个任务用英文分号分隔
+    未配置时使用 sku_id、buy_time、continue_time、seckill_num 组成单个任务
+    :return: SeckillTask列表
+    """
+    tasks = []
+    default_num = int(global_config.getRaw('config', 'seckill_num', '') or 2)
+    value = global_config.getRaw('config', 'seckill_tasks', '')
+    for item in value.split(';'):
+        if not item.strip():
+            continue
+        fields = [field.strip() for field in item.split('|')]
+        sku_id = fields[0]
+        # 显式配置的任务必须给出正确的抢购时间，不使用默认时间，以免在错误的时间抢购
+        buy_time = parse_buy_time(fields[1] if len(fields) > 1 else '', strict=True)
+        try:
+            continue_time = int(fields[2]) if len(fields) > 2 and fields[2] else \
+                int(global_config.getRaw('config', 'continue_time'))
+            seckill_num = int(fields[3]) if len(fields) > 3 and fields[3] else default_num
+        except ValueError:
+            raise SKException('抢购任务【{}】的运行时间或抢购数量格式错误'.format(item.strip()))
+        tasks.append(SeckillTask(sku_id, buy_time, continue_time, seckill_num))
+    if not tasks:
+        tasks.append(SeckillTask(global_config.getRaw('config', 'sku_id'),
+                                 parse_buy_time(global_config.getRaw('config', 'buy_time')),
+                                 int(global_config.getRaw('config', 'continue_time')),
+                                 default_num))
+    return tasks
+
+
+class SeckillScheduler(object):
+    """
+    单进程多商品抢购调度器
+    抢购任务按抢购时间放入最小堆，依次在抢购时间前 prepare_time 毫秒启动抢购线程；
+    所有任务共用同一个Session（连接池）和同一次时间同步结果，
+    每个线程内的链接轮询与单商品抢购一样按京东服务器时间精确等待
+    """
+
+    def __init__(self, jd_seckill, tasks):
+        self.jd_seckill = jd_seckill
+        self.tasks = tasks
+        self.prepare_time = int(global_config.getRaw('config', 'seckill_task_prepare_time', '5000'))
+
+    def _task_seckill(self, task):
+        """
+        生成单个任务使用的JdSeckill，共用Session、时间差以及登录、eid/fp等预热结果
+        """
+        seckill = copy.copy(self.jd_seckill)
+        seckill.sku_id = task.sku_id
+        seckill.continue_time = task.continue_time
+        seckill.seckill_num = task.seckill_num
+        seckill._timers = self.jd_seckill.timers.with_buy_time(task.buy_time)
+        seckill.sku_title = None
+        if seckill.seckill_url_hedger:
+            # 不同商品的耗时分布和对冲次数分别统计
+            seckill.seckill_url_hedger = HedgedGetter(seckill.session, 'seckill_url')
+        seckill.running_flag = True
+        return seckill
+
+    def run(self):
+        heap = []
+        for index, task in enumerate(self.tasks):
+            stop_time = task.buy_time + timedelta(minutes=task.continue_time)
+            if stop_time <= get_clock().now():
+                logger.info('抢购任务【%s】已超过允许的运行时间，跳过', task)
+                continue
+            seckill = self._task_seckill(task)
+            heapq.heappush(heap, (seckill.timers.buy_time_ms, index, seckill))
+        logger.info('共%s个抢购任务: %s', len(heap), [item[2].sku_id for item in sorted(heap)])
+
+        threads = []
+        while heap:
+            buy_time_ms, _, seckill = heapq.heappop(heap)
+            self.jd_seckill.timers.wait_until(buy_time_ms - self.prepare_time)
+            logger.info('启动商品【%s】的抢购，抢购时间: %s', seckill.sku_id, seckill.timers.buy_time)
+            thread = threading.Thread(target=seckill._seckill, name='seckill-{}'.format(seckill.sku_id))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        logger.info('所有抢购任务已结束')
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .jd_logger import logger
+from .exception import SKException
+from .profiling import profile_phase
+
+
+class Stage(object):
+    def __init__(self, name, func, deps=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StageRunner(object):
+    """
+    预热阶段依赖图执行器
+    互不依赖的阶段在线程池中并发执行，存在依赖的阶段等待依赖全部完成后再执行，
+    结束后输出各阶段耗时及关键路径
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.timings = dict()
+
+    def add(self, name, func, deps=()):
+        """
+        注册阶段
+        :param name: 阶段名称
+        :param func: 无参数的执行函数
+        :param deps: 依赖的阶段名称
+        :return:
+        """
+        self.stages[name] = Stage(name, func, deps)
+        return self
+
+    def _resolve(self, targets):
+        """
+        计算执行目标阶段所需的全部阶段（含间接依赖），并检查未知依赖与循环依赖
+        """
+        needed = OrderedDict()
+        visiting = set()
+
+        def visit(name):
+            if name in needed:
+                return
+            if name not in self.stages:
+                raise SKException('未知的预热阶段: {}'.format(name))
+            if name in visiting:
+                raise SKException('预热阶段存在循环依赖: {}'.format(name))
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            needed[name] = self.stages[name]
+
+        for target in (targets if targets is not None else self.stages.keys()):
+            visit(target)
+        return needed
+
+    def run(self, targets=None, done=None):
+        """
+        执行阶段
+        :param targets: 需要完成的阶段名称，None表示全部
+        :param done: 已经完成、无需重复执行的阶段名称集合，执行成功的阶段会加入该集合
+        :return: 已完成的阶段名称集合
+        """
+        done = done if done is not None else set()
+        pending = OrderedDict((name, stage) for name, stage in self._resolve(targets).items() if name not in done)
+        if not pending:
+            return done
+
+        begin = time.perf_counter()
+        running = dict()
+        error = None
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix='warm-up') as pool:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(dep in done for dep in stage.deps):
+                            del pending[name]
+                            running[pool.submit(self._run_stage, stage, begin)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                        done.add(name)
+                    except Exception as e:
+                        logger.error('预热阶段【%s】执行失败: %s', name, e)
+                        error = error or e
+
+        self.report(time.perf_counter() - begin)
+        if error is not None:
+            raise error
+        return done
+
+    def _run_stage(self, stage, begin):
+        start = time.perf_counter() - begin
+        try:
+            with profile_phase('warmup', stage.name):
+                stage.func()
+        finally:
+            self.timings[stage.name] = (start, time.perf_counter() - begin)
+
+    def critical_path(self):
+        """
+        从最晚结束的阶段出发，沿着最晚结束的依赖回溯，得到决定总耗时的关键路径
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while True:
+            deps = [dep for dep in self.stages[name].deps if dep in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: self.timings[n][1])
+            path.append(name)
+        return list(reversed(path))
+
+    def report(self, elapsed):
+        serial = sum(end - start for start, end in self.timings.values())
+        logger.info('预热完成，总耗时【%.3f】秒，串行执行需【%.3f】秒', elapsed, serial)
+        for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            logger.info('  阶段【%s】开始于 %.3f 秒，耗时 %.3f 秒', name, start, end - start)
+        path = self.critical_path()
+        logger.info('  关键路径: %s', ' -> '.join(
+            '{}({:.3f}s)'.format(name, self.timings[name][1] - self.timings[name][0]) for name in path))
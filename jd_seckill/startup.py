@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import importlib
+import time
+
+from .jd_logger import logger
+from .config import global_config
+
+
+class StartupTimer(object):
+    """
+    启动耗时统计
+    记录启动过程中各步骤及重量级依赖首次导入的耗时，开启 startup_report 后输出报告
+    """
+
+    def __init__(self):
+        self.begin = time.perf_counter()
+        self.last = self.begin
+        self.marks = []
+        self.imports = []
+        # 等待用户输入等不属于启动过程的耗时
+        self.excluded = 0.0
+        self.reported = False
+
+    def mark(self, name, exclude=False):
+        """
+        记录从上一个记录点到现在的耗时
+        :param name: 步骤名称
+        :param exclude: 为True时该段耗时（如等待用户输入）不计入启动耗时
+        :return:
+        """
+        now = time.perf_counter()
+        if exclude:
+            self.excluded += now - self.last
+        else:
+            self.marks.append((name, now - self.last))
+        self.last = now
+
+    def lazy_import(self, name):
+        """
+        按需导入模块，并记录首次导入的耗时
+        :param name: 模块名称，如 lxml.etree
+        :return: 模块对象
+        """
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start
+        # 已导入过的模块耗时可以忽略
+        if elapsed > 0.001:
+            self.imports.append((name, elapsed))
+        return module
+
+    def report(self):
+        if self.reported or global_config.getRaw('config', 'startup_report', 'false') != 'true':
+            return
+        self.reported = True
+        logger.info('启动耗时报告，距进程启动【%.3f】秒（不含等待输入的%.3f秒）',
+                    time.perf_counter() - self.begin - self.excluded, self.excluded)
+        for name, elapsed in self.marks:
+            logger.info('  步骤【%s】耗时 %.3f 秒', name, elapsed)
+        for name, elapsed in self.imports:
+            logger.info('  按需导入【%s】耗时 %.3f 秒', name, elapsed)
+
+
+startup_timer = StartupTimer()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- encoding=utf8 -*-
 
+import copy
 import time
 import requests
 import json
@@ -9,23 +10,63 @@ from datetime import datetime
 
 from .jd_logger import logger
 from .config import global_config
+from .clock import get_clock
+from . import metrics, journal
+from .exception import SKException
+
+
+def parse_buy_time(value, strict=False):
+    """
+    解析抢购时间，格式 '2018-09-28 22:45:50.000'
+    :param value: 抢购时间字符串
+    :param strict: 为True时解析失败抛出SKException，不使用默认时间
+    :return: datetime，解析失败时使用当天的 09:59:59.800
+    """
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
+    except Exception as e:
+        if strict:
+            raise SKException('抢购时间【{}】格式错误，应为 2021-01-12 09:59:59.820'.format(value))
+        # 如果没有配置购买时间，就使用当天的时间，2021-01-13 09:59:59.800
+        return datetime.strptime((get_clock().now().strftime("%Y-%m-%d") + " 09:59:59.800")
+                                 , "%Y-%m-%d %H:%M:%S.%f")
 
 
 class Timer(object):
-    def __init__(self, sleep_interval=0.5):
-        # '2018-09-28 22:45:50.000'
-        self.buy_time = None
-        try:
-            self.buy_time = datetime.strptime(global_config.getRaw('config', 'buy_time'), "%Y-%m-%d %H:%M:%S.%f")
-        except Exception as e:
-            # 如果没有配置购买时间，就使用当天的时间，2021-01-13 09:59:59.800
-            self.buy_time = datetime.strptime((time.strftime("%Y-%m-%d", time.localtime()) + " 09:59:59.800")
-                                              , "%Y-%m-%d %H:%M:%S.%f")
+    def __init__(self, sleep_interval=0.5, sync=True, buy_time=None, session=None):
+        """
+        :param sync: 是否立即同步京东服务器时间
+        :param buy_time: 抢购时间datetime，为空时读取配置文件
+        :param session: 获取京东服务器时间使用的Session，与抢购共用连接池
+        """
+        self.session = session
+        # 获取京东服务器时间的对冲请求，为None时直接请求
+        self.hedger = None
+        self.set_buy_time(buy_time or parse_buy_time(global_config.getRaw('config', 'buy_time')))
+        self.sleep_interval = sleep_interval
+
+        self.diff_time = 0
+        # 时间差的误差范围，为获取京东服务器时间往返耗时的一半
+        self.diff_error = 0
+        # 最近一次时间同步的本地时间戳
+        self.synced_at = 0
+        if sync:
+            self.sync_time()
+
+    def set_buy_time(self, buy_time):
+        self.buy_time = buy_time
         logger.info('配置的抢购时间为: %s', self.buy_time)
         self.buy_time_ms = int(time.mktime(self.buy_time.timetuple()) * 1000.0 + self.buy_time.microsecond / 1000)
-        self.sleep_interval = sleep_interval
 
-        self.diff_time = self.local_jd_time_diff()
+    def with_buy_time(self, buy_time):
+        """
+        复制一个抢购时间不同的Timer，共用已同步的时间差
+        :param buy_time: 抢购时间datetime
+        :return:
+        """
+        timer = copy.copy(self)
+        timer.set_buy_time(buy_time)
+        return timer
 
     def jd_time(self):
         """
@@ -33,7 +74,8 @@ class Timer(object):
         :return:
         """
         url = 'https://api.m.jd.com/client.action?functionId=queryMaterialProducts&client=wh5'
-        ret = requests.get(url).text
+        getter = self.hedger.get if self.hedger else (self.session or requests).get
+        ret = getter(url).text
         js = json.loads(ret)
         return int(js["currentTime2"])
 
@@ -42,25 +84,63 @@ class Timer(object):
         获取本地毫秒时间
         :return:
         """
-        return int(round(time.time() * 1000))
+        return int(round(get_clock().time() * 1000))
 
-    def local_jd_time_diff(self):
+    def local_jd_time_diff(self, samples=3):
         """
         计算本地与京东服务器时间差
+        以请求前后本地时间的中点对应京东服务器时间，误差不超过往返耗时的一半；
+        多次采样取往返耗时最短的一次
         :return:
         """
-        return self.local_time() - self.jd_time()
+        best = None
+        for _ in range(samples):
+            start = self.local_time()
+            jd_time = self.jd_time()
+            end = self.local_time()
+            if best is None or end - start < best[0]:
+                best = (end - start, (start + end) // 2 - jd_time)
+        self.diff_error = best[0] // 2
+        return best[1]
+
+    def sync_time(self):
+        """
+        同步本地与京东服务器时间差
+        :return:
+        """
+        self.diff_time = self.local_jd_time_diff()
+        self.synced_at = get_clock().time()
+        logger.info('本地时间与京东服务器时间误差为【%s】毫秒，误差范围【±%s】毫秒', self.diff_time, self.diff_error)
+        metrics.set_gauge('jd_seckill_clock_offset_ms', self.diff_time)
+        metrics.set_gauge('jd_seckill_clock_error_ms', self.diff_error)
+        journal.record('clock_sync', diff_time=self.diff_time, diff_error=self.diff_error)
+
+    def jd_now(self):
+        """
+        按时间差换算出的当前京东服务器毫秒时间
+        :return:
+        """
+        return self.local_time() - self.diff_time
+
+    def wait_until(self, target_ms):
+        """
+        等待到达指定的京东服务器毫秒时间
+        距离目标较远时按 sleep_interval 休眠，临近目标时缩短休眠，避免整段 sleep_interval 的延迟
+        :param target_ms: 京东服务器毫秒时间
+        :return:
+        """
+        while True:
+            remain_ms = target_ms - self.jd_now()
+            if remain_ms <= 0:
+                return
+            get_clock().sleep(min(self.sleep_interval, max(remain_ms / 2000.0, 0.001)))
 
     def start(self):
         logger.info('正在等待到达设定时间:{}，检测本地时间与京东服务器时间误差为【{}】毫秒'.format(self.buy_time, self.diff_time))
-        while True:
-            # 本地时间减去与京东的时间差，能够将时间误差提升到0.1秒附近
-            # 具体精度依赖获取京东服务器时间的网络时间损耗
-            if self.local_time() - self.diff_time >= self.buy_time_ms:
-                logger.info('时间到达，开始执行……')
-                break
-            else:
-                time.sleep(self.sleep_interval)
+        # 本地时间减去与京东的时间差，能够将时间误差提升到0.1秒附近
+        # 具体精度依赖获取京东服务器时间的网络时间损耗
+        self.wait_until(self.buy_time_ms)
+        logger.info('时间到达，开始执行……')
 
     def buytime_get(self):
         """获取开始抢购的时间"""
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import os
+import threading
+import time
+
+from .jd_logger import logger
+from .config import global_config
+from . import metrics
+from .worker import get_mp_context
+
+# 表示请求过快、系统繁忙的下单返回码，出现比例过高时减少同时下单的进程
+REJECT_CODES = (60017, 90013)
+
+# 子进程中由 init_worker 设置的共享计数
+_active = None
+_attempts = None
+_rejections = None
+
+
+def init_worker(active, attempts, rejections):
+    """
+    进程池子进程初始化，保存与主进程共享的计数
+    """
+    global _active, _attempts, _rejections
+    _active, _attempts, _rejections = active, attempts, rejections
+
+
+def may_attempt(worker_id):
+    """
+    编号小于当前允许数量的进程才可以下单，未启用自动调整时总是允许
+    """
+    return _active is None or worker_id < _active.value
+
+
+def report_result(code):
+    """
+    记录一次下单的返回码
+    """
+    if _attempts is None:
+        return
+    with _attempts.get_lock():
+        _attempts.value += 1
+    if code in REJECT_CODES:
+        with _rejections.get_lock():
+            _rejections.value += 1
+
+
+class WorkerTuner(object):
+    """
+    自动调整同时下单的进程数量（work_count = auto）
+        1、初始数量取CPU核数，且不超过 work_max_count 的一半：开抢最初几秒决定结果，宁可从较少的进程开始，
+           避免一开始就因请求过快被拒绝，再由下面的统计逐步增加；往返耗时只记录在日志中，测量请求同时预先建立连接
+        2、抢购期间每 work_tune_interval 秒统计一次下单返回码：
+           请求过快的比例超过 30% 时减少 1 个，低于 5% 时增加 1 个，每次调整都会记录日志
+    进程池按 work_max_count 创建，未轮到的进程只轮询抢购链接，不提交订单
+    """
+
+    def __init__(self):
+        self.cpu_count = os.cpu_count() or 1
+        self.max_workers = int(global_config.getRaw('config', 'work_max_count', '') or self.cpu_count * 2)
+        self.interval = float(global_config.getRaw('config', 'work_tune_interval', '2'))
+        # 共享计数需要与进程池使用同一种启动方式创建
+        mp_context = get_mp_context()
+        self.active = mp_context.Value('i', 1)
+        self.attempts = mp_context.Value('i', 0)
+        self.rejections = mp_context.Value('i', 0)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def initargs(self):
+        return self.active, self.attempts, self.rejections
+
+    @staticmethod
+    def measure_rtt(session, samples=3):
+        """
+        测量到 marathon.jd.com 的往返耗时中位数
+        :return: 毫秒，测量失败时返回None
+        """
+        rtts = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            try:
+                session.head('https://marathon.jd.com/', allow_redirects=False, timeout=3)
+            except Exception as e:
+                logger.info('测量往返耗时失败: %s', e)
+                continue
+            rtts.append((time.perf_counter() - start) * 1000)
+        return sorted(rtts)[len(rtts) // 2] if rtts else None
+
+    def initial_count(self):
+        return max(1, min(self.cpu_count, self.max_workers // 2))
+
+    def set_active(self, count, reason):
+        count = max(1, min(self.max_workers, count))
+        if count != self.active.value:
+            logger.info('同时下单的进程数量 %s -> %s，%s', self.active.value, count, reason)
+            self.active.value = count
+        metrics.set_gauge('jd_seckill_active_workers', count)
+
+    def start(self, session):
+        rtt = self.measure_rtt(session)
+        self.set_active(self.initial_count(), 'CPU核数{}，往返耗时{}毫秒'.format(
+            self.cpu_count, '未知' if rtt is None else int(rtt)))
+        self.thread = threading.Thread(target=self._run, name='worker-tuner', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        last_attempts = last_rejections = 0
+        while not self.stopped.wait(self.interval):
+            attempts, rejections = self.attempts.value, self.rejections.value
+            delta_attempts, delta_rejections = attempts - last_attempts, rejections - last_rejections
+            last_attempts, last_rejections = attempts, rejections
+            if delta_attempts == 0:
+                continue
+            rate = delta_rejections / float(delta_attempts)
+            reason = '最近{}秒下单{}次，请求过快{}次'.format(self.interval, delta_attempts, delta_rejections)
+            if rate > 0.3:
+                self.set_active(self.active.value - 1, reason)
+            elif rate < 0.05:
+                self.set_active(self.active.value + 1, reason)
@@ -5,15 +5,13 @@ import json
 import random
 import requests
 import os
-import time
-import smtplib
-
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.image import MIMEImage
+import io
+import subprocess
 
 from .config import global_config
 from .jd_logger import logger
+from .startup import startup_timer
+from .clock import get_clock
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36",
@@ -68,6 +66,29 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 6.2; WOW64) AppleWebKit/537.14 (KHTML, like Gecko) Chrome/24.0.1292.0 Safari/537.14"
 ]
 
+# 请求所属阶段，按url特征匹配
+STAGE_URL_PATTERNS = [
+    ('seckill_url', 'itemko.jd.com/itemShowBtn'),
+    ('seckill_page', 'marathon.jd.com/captcha.html'),
+    ('checkout', 'marathon.jd.com/seckill/seckill.action'),
+    ('init', 'orderService/pc/init.action'),
+    ('submit', 'orderService/pc/submitOrder.action'),
+    ('jd_time', 'functionId=queryMaterialProducts'),
+    ('login_check', 'order.jd.com/center/list.action'),
+    ('qrcode', 'qr.m.jd.com'),
+    ('login', 'passport.jd.com'),
+    ('reserve', 'yushou.jd.com'),
+    ('sku_title', 'item.jd.com'),
+]
+
+
+def get_stage(url):
+    """根据url判断请求所属阶段"""
+    for stage, pattern in STAGE_URL_PATTERNS:
+        if pattern in url:
+            return stage
+    return 'other'
+
 
 def parse_json(s):
     begin = s.find('{')
@@ -82,8 +103,28 @@ def get_random_useragent():
     return random.choice(USER_AGENTS)
 
 
+def read_json_file(path, default=None):
+    """读取json文件，文件不存在或内容损坏时返回default"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_file(path, data):
+    """先写临时文件再替换，保证json文件不会因中途退出而损坏"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
 def wait_some_time():
-    time.sleep(random.randint(100, 300) / 1000)
+    get_clock().sleep(random.randint(100, 300) / 1000)
 
 
 def send_wechat(message):
@@ -107,27 +148,108 @@ def response_status(resp):
 
 
 def open_image(image_file):
+    """打开图片，不等待图片查看器退出，以免阻塞扫码结果的轮询"""
     if os.name == "nt":
-        os.system('start ' + image_file)  # for Windows
-    else:
-        if os.uname()[0] == "Linux":
-            if "deepin" in os.uname()[2]:
-                os.system("deepin-image-viewer " + image_file)  # for deepin
-            else:
-                os.system("eog " + image_file)  # for Linux
+        os.startfile(image_file)  # for Windows
+        return
+    if os.uname()[0] == "Linux":
+        if "deepin" in os.uname()[2]:
+            viewer = "deepin-image-viewer"  # for deepin
         else:
-            os.system("open " + image_file)  # for Mac
+            viewer = "eog"  # for Linux
+    else:
+        viewer = "open"  # for Mac
+    try:
+        subprocess.Popen([viewer, image_file], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        logger.info('无法打开图片查看器，请手动打开 %s', os.path.abspath(image_file))
+
+
+def qrcode_show_mode():
+    """
+    二维码的展示方式：image 使用图片查看器打开；terminal 直接在终端中打印；
+    auto 在没有图形界面的 Linux（未设置 DISPLAY/WAYLAND_DISPLAY）上使用 terminal，否则使用 image
+    """
+    mode = (global_config.getRaw('account', 'qrcode_show_mode', fallback='') or 'auto').strip().lower()
+    if mode in ('image', 'terminal'):
+        return mode
+    if os.name != 'nt' and os.uname()[0] == 'Linux' \
+            and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY'):
+        return 'terminal'
+    return 'image'
+
+
+def decode_qr_matrix(image_bytes):
+    """
+    从二维码图片中还原模块矩阵
+    以左上角定位图案的宽度（7个模块）推算模块大小，再对每个模块的中心点采样
+    :return: 二维列表，True 表示深色模块；无法识别时返回 None
+    """
+    Image = startup_timer.lazy_import('PIL.Image')
+    img = Image.open(io.BytesIO(image_bytes)).convert('L')
+    bw = img.point(lambda p: 255 if p < 128 else 0)
+    bbox = bw.getbbox()
+    if not bbox:
+        return None
+    left, top, right, bottom = bbox
+    pixels = img.load()
 
+    def dark(x, y):
+        return pixels[x, y] < 128
 
-def save_image(resp, image_file):
-    with open(image_file, 'wb') as f:
-        for chunk in resp.iter_content(chunk_size=1024):
-            f.write(chunk)
+    run = 0
+    while left + run < right and dark(left + run, top):
+        run += 1
+    module = run / 7.0
+    if module < 1:
+        return None
+    size = int(round((right - left) / module))
+    if size < 21:
+        return None
+    return [[dark(min(int(left + (col + 0.5) * module), right - 1), min(int(top + (row + 0.5) * module), bottom - 1))
+             for col in range(size)] for row in range(size)]
+
+
+def render_qr_matrix(matrix, quiet_zone=2):
+    """
+    用半高方块字符渲染二维码，每行字符对应两行模块
+    浅色模块输出为方块，适合深色背景的终端
+    """
+    size = len(matrix) + quiet_zone * 2
+    padded = [[False] * size for _ in range(quiet_zone)]
+    for row in matrix:
+        padded.append([False] * quiet_zone + list(row) + [False] * quiet_zone)
+    padded.extend([False] * size for _ in range(quiet_zone + len(padded) % 2))
+    chars = {(False, False): '\u2588', (False, True): '\u2580', (True, False): '\u2584', (True, True): ' '}
+    lines = []
+    for y in range(0, len(padded), 2):
+        lines.append(''.join(chars[(padded[y][x], padded[y + 1][x])] for x in range(size)))
+    return '\n'.join(lines)
+
+
+def print_qr_in_terminal(image_bytes):
+    """
+    在终端中打印二维码，需要PIL解码图片
+    :return: 打印成功返回 True，否则返回 False 以便回退到图片文件
+    """
+    try:
+        matrix = decode_qr_matrix(image_bytes)
+    except ImportError:
+        logger.info("加载PIL失败，无法在终端中打印二维码，请查看requirements.txt")
+        return False
+    except Exception as e:
+        logger.info('二维码解析失败，无法在终端中打印：%s', e)
+        return False
+    if not matrix:
+        logger.info('二维码解析失败，无法在终端中打印')
+        return False
+    print(render_qr_matrix(matrix), flush=True)
+    return True
 
 
 def add_bg_for_qr(qr_path):
     try:
-        from PIL import Image
+        Image = startup_timer.lazy_import('PIL.Image')
         qr = Image.open(qr_path)
         w = qr.width
         h = qr.width
@@ -145,10 +267,8 @@ def add_bg_for_qr(qr_path):
 class Email():
 
     def __init__(self, mail_user, mail_pwd, mail_host=''):
-        if global_config.getRaw('messenger', 'email_enable') == 'false':
-            return
-
-        smtpObj = smtplib.SMTP()
+        # 只记录配置，首次发送邮件时才导入smtplib并登录
+        self.enable = global_config.getRaw('messenger', 'email_enable') != 'false'
         # 没传会自动判断 判断不出来默认QQ邮箱
         if mail_host:
             self.mail_host = mail_host
@@ -163,14 +283,23 @@ class Email():
         else:
             self.mail_host = 'smtp.qq.com'
         self.mail_user = mail_user
+        self.mail_pwd = mail_pwd
         self.is_login = False
+        self.smtpObj = None
+
+    def _login(self):
+        if self.smtpObj is not None:
+            return self.is_login
+        smtplib = startup_timer.lazy_import('smtplib')
+        smtpObj = smtplib.SMTP()
         try:
-            smtpObj.connect(mail_host, 25)
-            smtpObj.login(mail_user, mail_pwd)
+            smtpObj.connect(self.mail_host, 25)
+            smtpObj.login(self.mail_user, self.mail_pwd)
             self.is_login = True
         except Exception as e:
-            logger.info('邮箱登录失败!', e)
+            logger.info('邮箱登录失败! %s', e)
         self.smtpObj = smtpObj
+        return self.is_login
 
     def send(self, title, msg, receivers: list, img=''):
         """
@@ -181,7 +310,13 @@ class Email():
         :param img: 图片名
         :return:
         """
-        if self.is_login:
+        if not self.enable:
+            return
+        if self._login():
+            from email.mime.text import MIMEText
+            from email.mime.multipart import MIMEMultipart
+            from email.mime.image import MIMEImage
+
             message = MIMEMultipart('alternative')
             msg_html = MIMEText(msg, 'html', 'utf-8')
             message.attach(msg_html)
@@ -195,7 +330,7 @@ class Email():
             try:
                 self.smtpObj.sendmail(self.mail_user, receivers, message.as_string())
             except Exception as e:
-                logger.info('邮件发送失败!', e)
+                logger.info('邮件发送失败! %s', e)
         else:
             logger.info('邮箱未登录')
 
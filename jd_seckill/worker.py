@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+
+import multiprocessing
+import os
+import sys
+
+from .jd_logger import logger
+from . import metrics
+
+
+def get_max_rss():
+    """
+    当前进程的内存占用峰值；单位：字节，无法获取时返回None
+    Linux 的 ru_maxrss 在 fork、exec 后仍保留父进程的峰值，优先读取只统计本进程地址空间的 VmHWM
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows 没有 resource 模块
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，Mac 单位为字节
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def report_memory(worker_id, when):
+    max_rss = get_max_rss()
+    if max_rss is None:
+        return
+    logger.info('抢购进程【%s】%s，内存占用峰值【%.1f】MB，已加载模块%s个',
+                worker_id, when, max_rss / 1024.0 / 1024.0, len(sys.modules))
+    metrics.set_gauge('jd_seckill_worker_max_rss_bytes', max_rss)
+
+
+def get_mp_context():
+    """
+    抢购进程池使用 spawn 方式启动子进程：子进程不继承父进程预热阶段加载的模块和对象，
+    只加载抢购所需的模块，内存占用峰值也只统计子进程自身
+    """
+    return multiprocessing.get_context('spawn')
+
+
+def make_snapshot(jd_seckill):
+    """
+    生成抢购子进程所需的最小数据：cookie、请求头、商品、下单参数、抢购时间及时间差
+    :param jd_seckill: 已完成预热的JdSeckill
+    :return: dict
+    """
+    timers = jd_seckill.timers
+    return {
+        'cookies': [{
+            'name': cookie.name,
+            'value': cookie.value,
+            'domain': cookie.domain,
+            'path': cookie.path,
+            'expires': cookie.expires,
+            'secure': cookie.secure,
+        } for cookie in jd_seckill.session.cookies],
+        'headers': dict(jd_seckill.session.headers),
+        'user_agent': jd_seckill.user_agent,
+        'sku_id': jd_seckill.sku_id,
+        'sku_title': jd_seckill.sku_title,
+        'nick_name': jd_seckill.nick_name,
+        'seckill_num': jd_seckill.seckill_num,
+        'order_bodies': dict(jd_seckill.order_bodies),
+        'continue_time': jd_seckill.continue_time,
+        'eid_fp': jd_seckill.get_eid_fp(),
+        'buy_time': timers.buy_time,
+        'diff_time': timers.diff_time,
+        'diff_error': timers.diff_error,
+    }
+
+
+def run_worker(snapshot, worker_id):
+    """
+    抢购子进程入口，只根据snapshot重建抢购所需的对象，不包含扫码登录、eid/fp获取等预热相关对象
+    :param snapshot: make_snapshot 生成的数据
+    :param worker_id: 进程编号
+    :return:
+    """
+    from .jd_spider_requests import JdSeckill
+
+    report_memory(worker_id, '启动')
+    jd_seckill = JdSeckill.from_snapshot(snapshot)
+    report_memory(worker_id, '完成初始化 (pid={})'.format(os.getpid()))
+    try:
+        jd_seckill.run_seckill(worker_id)
+    finally:
+        report_memory(worker_id, '结束')
@@ -1,8 +1,35 @@
 import sys
+import argparse
+from jd_seckill.startup import startup_timer
 from jd_seckill.jd_spider_requests import JdSeckill
+from jd_seckill import metrics, profiling, journal
+
+startup_timer.mark('导入模块')
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', action='store_true',
+                        help='分别统计预热阶段和抢购阶段的耗时，每个进程输出一个统计文件并生成合并摘要')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('daemon', help='常驻模式，按 [daemon] 配置每日执行预约和抢购')
+    journal_parser = subparsers.add_parser('journal', help='分析 journal_file 中的运行记录')
+    journal_parser.add_argument('--run', help='运行编号，默认为最近一次')
+    journal_parser.add_argument('--compare', type=int, default=5, help='与之前多少次运行对比')
+    args = parser.parse_args()
+
+    if args.command == 'journal':
+        journal.analyze(args.run, args.compare)
+        sys.exit(0)
+    if args.profile:
+        profiling.enable()
+    profiling.reset()
+
+    if args.command == 'daemon':
+        metrics.start_server()
+        JdSeckill().run_daemon()
+        sys.exit(0)
+
     a = """
 
        oooo oooooooooo.            .oooooo..o                     oooo         o8o  oooo  oooo  
@@ -17,16 +44,26 @@ if __name__ == '__main__':
 功能列表：                                                                                
  1.预约商品
  2.秒杀抢购商品
+ 3.多商品定时抢购
+ 4.批量预约商品
     """
     print(a)
 
+    metrics.start_server()
     jd_seckill = JdSeckill()
+    startup_timer.mark('初始化')
     choice_function = input('请选择:')
+    startup_timer.mark('等待输入', exclude=True)
     if choice_function == '1':
         jd_seckill.reserve()
     elif choice_function == '2':
         jd_seckill.seckill_by_proc_pool()
+    elif choice_function == '3':
+        jd_seckill.seckill_by_schedule()
+    elif choice_function == '4':
+        jd_seckill.reserve_by_thread_pool()
     else:
         print('没有此功能')
         sys.exit(1)
+    profiling.write_summary()
 
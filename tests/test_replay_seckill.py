@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- encoding=utf8 -*-
+"""
+使用回放记录和模拟时钟跑完整的抢购流程，不访问网络，毫秒级完成
+需要在项目根目录（config.ini 所在目录）下运行 pytest
+"""
+
+import gzip
+import json
+import time
+
+from datetime import datetime
+
+import pytest
+
+from jd_seckill import clock
+from jd_seckill.clock import SimulatedClock, get_clock, set_clock
+from jd_seckill.exception import SKException
+from jd_seckill.jd_spider_requests import JdSeckill
+from jd_seckill.replay import ReplayAdapter
+from jd_seckill.timer import Timer
+
+BUY_TIME = datetime(2021, 1, 12, 10, 0, 0)
+SKU_ID = '100012043978'
+
+INIT_INFO = {
+    'address': {
+        'id': 1, 'name': '***', 'provinceId': 1, 'cityId': 2, 'countyId': 3, 'townId': 4,
+        'addressDetail': '***', 'mobile': '***', 'mobileKey': '***',
+    },
+    'invoiceInfo': {},
+    'token': '***',
+}
+
+# 按 RecordingAdapter 的格式记录的一次抢购：开抢前抢购链接尚未开放，开抢后获取到链接并下单成功
+RECORDS = [
+    ('GET', 'seckill_url', 'https://itemko.jd.com/itemShowBtn', 'jQuery1({})', 0.03, 200),
+    ('GET', 'seckill_url', 'https://itemko.jd.com/itemShowBtn',
+     'jQuery1({"url": "//divide.jd.com/user_routing?skuId=%s&sn=***&from=pc"})' % SKU_ID, 0.03, 200),
+    ('GET', 'seckill_page', 'https://marathon.jd.com/captcha.html', '', 0.05, 302),
+    ('GET', 'checkout', 'https://marathon.jd.com/seckill/seckill.action', '', 0.05, 302),
+    ('POST', 'init', 'https://marathon.jd.com/seckillnew/orderService/pc/init.action',
+     json.dumps(INIT_INFO), 0.2, 200),
+    ('POST', 'submit', 'https://marathon.jd.com/seckillnew/orderService/pc/submitOrder.action',
+     json.dumps({'success': True, 'orderId': 1, 'totalMoney': '1499.00', 'pcUrl': '//order.jd.com/***',
+                 'resultCode': 0, 'skuId': 0}), 0.3, 200),
+]
+
+
+def write_records(path):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for i, (method, stage, url, body, elapsed, status) in enumerate(RECORDS):
+            f.write(json.dumps({
+                'stage': stage,
+                'method': method,
+                'url': url,
+                'request_body': None,
+                'start': i,
+                'elapsed': elapsed,
+                'status': status,
+                'reason': 'OK',
+                'headers': {'Content-Type': 'application/json'},
+                'body': body,
+            }) + '\n')
+
+
+@pytest.fixture
+def simulated_clock():
+    sim = SimulatedClock(start=time.mktime(BUY_TIME.timetuple()) - 2)
+    set_clock(sim)
+    yield sim
+    set_clock(None)
+
+
+def test_replayed_seckill_completes_on_simulated_clock(tmp_path, simulated_clock):
+    record_file = tmp_path / 'record.1.jsonl.gz'
+    write_records(str(record_file))
+
+    jd_seckill = JdSeckill()
+    jd_seckill.sku_id = SKU_ID
+    jd_seckill.continue_time = 1
+    jd_seckill.seckill_url_hedger = None
+    jd_seckill.session.mount('https://', ReplayAdapter(str(record_file), speed=1))
+    jd_seckill._timers = Timer(sync=False, buy_time=BUY_TIME, session=jd_seckill.session)
+
+    begin = time.perf_counter()
+    jd_seckill.run_seckill()
+    elapsed = time.perf_counter() - begin
+
+    # 下单成功后结束抢购循环
+    assert not jd_seckill.running_flag
+    # 轮询最早在抢购时间前300毫秒开始，之后各请求按记录耗时推进模拟时间（共0.66秒）；
+    # 远早于 continue_time 结束，说明是下单成功而非超时
+    buy_ts = time.mktime(BUY_TIME.timetuple())
+    assert buy_ts + 0.3 <= get_clock().time() < buy_ts + 5
+    # 实际耗时远小于模拟的2秒多
+    assert elapsed < 1
+
+
+def test_simulated_clock_requires_replay(monkeypatch):
+    options = {('debug', 'simulated_clock'): 'true', ('debug', 'replay_file'): ''}
+    monkeypatch.setattr(clock.global_config, 'getRaw',
+                        lambda section, name, fallback=None: options.get((section, name), fallback))
+    set_clock(None)
+    with pytest.raises(SKException):
+        get_clock()
+    set_clock(None)